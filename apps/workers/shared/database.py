@@ -6,7 +6,7 @@ import asyncio
 import logging
 from typing import Optional
 import asyncpg
-import aioredis
+import redis.asyncio as redis
 from clickhouse_driver import Client as ClickHouseClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -17,67 +17,108 @@ logger = logging.getLogger(__name__)
 
 # Global connections
 pg_pool: Optional[asyncpg.Pool] = None
-redis_client: Optional[aioredis.Redis] = None
+redis_pool: Optional[redis.BlockingConnectionPool] = None
+redis_client: Optional[redis.Redis] = None
 clickhouse_client: Optional[ClickHouseClient] = None
 async_engine = None
 async_session_factory = None
 
+async def _init_pg(settings):
+    """Initialize the PostgreSQL connection pool"""
+    pool = await asyncpg.create_pool(
+        settings.database_url,
+        min_size=settings.pg_pool_min,
+        max_size=settings.pg_pool_max,
+        command_timeout=settings.pg_command_timeout,
+        max_inactive_connection_lifetime=300
+    )
+    logger.info("PostgreSQL pool initialized")
+    return pool
+
+async def _init_redis(settings):
+    """Initialize the Redis connection pool and client"""
+    # Bounded pool so burst load from all workers blocks on acquisition
+    # instead of exhausting file descriptors
+    pool = redis.BlockingConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.redis_pool_size,
+        timeout=20,
+        encoding="utf-8",
+        decode_responses=True
+    )
+    client = redis.Redis(connection_pool=pool)
+    await client.ping()
+    logger.info("Redis connection pool initialized")
+    return pool, client
+
+async def _init_ch(settings):
+    """Initialize the ClickHouse client"""
+    client = ClickHouseClient(
+        host=settings.clickhouse_host,
+        port=settings.clickhouse_port,
+        secure=settings.clickhouse_secure,
+        database=settings.clickhouse_database
+    )
+    # Test connection off the event loop
+    await asyncio.to_thread(client.execute, "SELECT 1")
+    logger.info("ClickHouse connection initialized")
+    return client
+
+async def _init_sa(settings):
+    """Initialize the SQLAlchemy async engine and session factory"""
+    engine = create_async_engine(
+        settings.database_url.replace("postgresql://", "postgresql+asyncpg://"),
+        echo=settings.debug,
+        pool_size=settings.sqlalchemy_pool_size,
+        max_overflow=settings.sqlalchemy_max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+    session_factory = sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    )
+    logger.info("SQLAlchemy async engine initialized")
+    return engine, session_factory
+
 async def init_database():
-    """Initialize database connections"""
-    global pg_pool, redis_client, clickhouse_client, async_engine, async_session_factory
-    
+    """Initialize database connections concurrently"""
+    global pg_pool, redis_pool, redis_client, clickhouse_client, async_engine, async_session_factory
+
     settings = get_settings()
-    
+
     try:
-        # PostgreSQL connection pool
-        pg_pool = await asyncpg.create_pool(
-            settings.database_url,
-            min_size=5,
-            max_size=20,
-            command_timeout=60
-        )
-        logger.info("PostgreSQL pool initialized")
-        
-        # Redis connection
-        redis_client = aioredis.from_url(
-            settings.redis_url,
-            encoding="utf-8",
-            decode_responses=True
-        )
-        await redis_client.ping()
-        logger.info("Redis connection initialized")
-        
-        # ClickHouse connection
-        clickhouse_client = ClickHouseClient(
-            host=settings.clickhouse_url.replace("http://", "").split(":")[0],
-            port=int(settings.clickhouse_url.split(":")[-1]) if ":" in settings.clickhouse_url else 8123,
-            database=settings.clickhouse_database
+        # Connect to all backends in parallel so cold start takes as long
+        # as the slowest handshake, not the sum of all four
+        pg_pool, (redis_pool, redis_client), clickhouse_client, (async_engine, async_session_factory) = await asyncio.gather(
+            _init_pg(settings),
+            _init_redis(settings),
+            _init_ch(settings),
+            _init_sa(settings)
         )
-        # Test connection
-        clickhouse_client.execute("SELECT 1")
-        logger.info("ClickHouse connection initialized")
-        
-        # SQLAlchemy async engine
-        async_engine = create_async_engine(
-            settings.database_url.replace("postgresql://", "postgresql+asyncpg://"),
-            echo=settings.debug
-        )
-        async_session_factory = sessionmaker(
-            async_engine, class_=AsyncSession, expire_on_commit=False
-        )
-        logger.info("SQLAlchemy async engine initialized")
-        
     except Exception as e:
         logger.error(f"Failed to initialize database connections: {e}")
         raise
 
-async def get_pg_connection():
-    """Get PostgreSQL connection from pool"""
+async def fetch_one_cached(sql: str, *args):
+    """Fetch a single row through asyncpg's statement cache.
+
+    pool.fetchrow routes through each connection's LRU statement cache
+    (statement_cache_size, 100 by default), so hot lookups skip the
+    Parse/plan round trip after the first call on each pooled
+    connection. An explicit conn.prepare would defeat that: it builds a
+    fresh named statement per call.
+    """
     if not pg_pool:
         raise RuntimeError("PostgreSQL pool not initialized")
-    return await pg_pool.acquire()
+    return await pg_pool.fetchrow(sql, *args)
 
-async def get_redis_client():
+def get_pg_pool() -> asyncpg.Pool:
+    """Get the PostgreSQL pool; callers acquire with `async with pool.acquire()`"""
+    if not pg_pool:
+        raise RuntimeError("PostgreSQL pool not initialized")
+    return pg_pool
+
+def get_redis_client() -> redis.Redis:
     """Get Redis client"""
     if not redis_client:
         raise RuntimeError("Redis client not initialized")
@@ -89,7 +130,30 @@ def get_clickhouse_client():
         raise RuntimeError("ClickHouse client not initialized")
     return clickhouse_client
 
-async def get_async_session():
+async def ch_execute(*args, **kwargs):
+    """Run a ClickHouse query without blocking the event loop.
+
+    Thin asyncio.to_thread wrapper over the synchronous driver's
+    execute; workers should use this instead of calling the client
+    directly on hot paths.
+    """
+    if not clickhouse_client:
+        raise RuntimeError("ClickHouse client not initialized")
+    return await asyncio.to_thread(clickhouse_client.execute, *args, **kwargs)
+
+async def ch_insert(table: str, rows: list, column_names: list):
+    """Insert rows into a ClickHouse table without blocking the event loop.
+
+    Accepts a batch of row dicts; callers should accumulate rows and
+    insert in batches rather than one row per call. The synchronous
+    driver runs in a thread so concurrent coroutines stay responsive.
+    """
+    if not clickhouse_client:
+        raise RuntimeError("ClickHouse client not initialized")
+    sql = f"INSERT INTO {table} ({', '.join(column_names)}) VALUES"
+    return await asyncio.to_thread(clickhouse_client.execute, sql, rows)
+
+def get_async_session():
     """Get SQLAlchemy async session"""
     if not async_session_factory:
         raise RuntimeError("Async session factory not initialized")
@@ -97,15 +161,17 @@ async def get_async_session():
 
 async def close_database():
     """Close all database connections"""
-    global pg_pool, redis_client, clickhouse_client, async_engine
-    
+    global pg_pool, redis_pool, redis_client, clickhouse_client, async_engine
+
     if pg_pool:
         await pg_pool.close()
         logger.info("PostgreSQL pool closed")
     
     if redis_client:
-        await redis_client.close()
-        logger.info("Redis connection closed")
+        await redis_client.aclose()
+        if redis_pool:
+            await redis_pool.disconnect()
+        logger.info("Redis connection pool closed")
     
     if clickhouse_client:
         clickhouse_client.disconnect()
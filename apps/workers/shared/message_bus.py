@@ -3,18 +3,23 @@ NATS message bus integration
 """
 
 import asyncio
-import json
 import logging
+import zlib
 from typing import Dict, Any, Callable, Optional
+
+import orjson
 import nats
 from nats.aio.client import Client as NATSClient
+from nats.errors import TimeoutError as NATSTimeoutError
+from nats.js.api import ConsumerConfig
 
 from .config import get_settings
 
 logger = logging.getLogger(__name__)
 
-# Global NATS client
+# Global NATS client and JetStream context
 nats_client: Optional[NATSClient] = None
+jetstream = None
 
 # Topic definitions
 TOPICS = {
@@ -29,61 +34,202 @@ TOPICS = {
 
 async def init_message_bus():
     """Initialize NATS message bus"""
-    global nats_client
-    
+    global nats_client, jetstream
+
     settings = get_settings()
-    
+
     try:
         nats_client = await nats.connect(settings.nats_url)
         logger.info("NATS connection initialized")
+
+        # JetStream for topics that need at-least-once delivery
+        jetstream = nats_client.jetstream()
+        for name, subjects in (
+            ("coach", ["coach.>"]),
+            ("deliver", ["deliver.>"]),
+            ("content", ["content.>"]),
+            ("event", ["event.>"]),
+        ):
+            try:
+                await jetstream.add_stream(name=name, subjects=subjects)
+            except Exception as e:
+                # Stream already exists (or JetStream is disabled on the server)
+                logger.debug(f"JetStream stream setup skipped for {name}: {e}")
     except Exception as e:
         logger.error(f"Failed to initialize NATS connection: {e}")
         raise
 
+def shard_topic(topic: str, shard_key: str, shards: int) -> str:
+    """Return the sharded subtopic for a key, e.g. content.make.2.
+
+    Publishers that want per-key ordering across a partitioned consumer
+    (the content worker's content.make.<n> shards) route through this so
+    every message for the same key lands on the same subtopic.
+    """
+    return f"{topic}.{zlib.crc32(shard_key.encode()) % shards}"
+
 async def publish_message(topic: str, data: Dict[str, Any], reply_to: Optional[str] = None):
     """Publish message to NATS topic"""
     if not nats_client:
         raise RuntimeError("NATS client not initialized")
     
     try:
-        message = json.dumps(data).encode()
+        message = orjson.dumps(data)
         await nats_client.publish(topic, message, reply=reply_to)
-        logger.debug(f"Published message to {topic}: {data}")
+        # Guard so the payload is never formatted unless debug is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Published message to %s: %s", topic, data)
     except Exception as e:
         logger.error(f"Failed to publish message to {topic}: {e}")
         raise
 
-async def subscribe_to_topic(topic: str, handler: Callable, queue_group: Optional[str] = None):
-    """Subscribe to NATS topic with handler"""
+async def subscribe_to_topic(
+    topic: str,
+    handler: Callable,
+    queue_group: Optional[str] = None,
+    max_concurrent: int = 64,
+    pending_msgs_limit: int = 65536,
+    pending_bytes_limit: int = 64 << 20,
+    use_jetstream: bool = False
+):
+    """Subscribe to NATS topic with handler.
+
+    Workers should always pass a queue_group so NATS load-balances
+    messages across replicas instead of broadcasting to each one.
+    max_concurrent bounds in-flight handler invocations so a burst
+    exerts backpressure on the subscription buffer (sized by the
+    pending limits) rather than spawning unbounded tasks and tripping
+    the slow-consumer drop.
+
+    With use_jetstream=True the subscription is durable with manual
+    acks and MaxAckPending credit control, giving at-least-once
+    delivery across worker restarts instead of core NATS's
+    at-most-once.
+    """
     if not nats_client:
         raise RuntimeError("NATS client not initialized")
-    
+
+    sem = asyncio.Semaphore(max_concurrent)
+
     async def message_handler(msg):
-        try:
-            data = json.loads(msg.data.decode())
-            await handler(data, msg)
-        except Exception as e:
-            logger.error(f"Error handling message from {topic}: {e}")
-    
+        async with sem:
+            try:
+                data = orjson.loads(msg.data)
+                await handler(data, msg)
+                if use_jetstream:
+                    await msg.ack()
+            except Exception as e:
+                logger.error(f"Error handling message from {topic}: {e}")
+
     try:
-        if queue_group:
-            await nats_client.subscribe(topic, queue=queue_group, cb=message_handler)
+        if use_jetstream:
+            if not jetstream:
+                raise RuntimeError("JetStream not initialized")
+            await jetstream.subscribe(
+                topic,
+                queue=queue_group or '',
+                durable=queue_group,
+                cb=message_handler,
+                manual_ack=True,
+                config=ConsumerConfig(max_ack_pending=256)
+            )
         else:
-            await nats_client.subscribe(topic, cb=message_handler)
+            await nats_client.subscribe(
+                topic,
+                queue=queue_group or '',
+                cb=message_handler,
+                pending_msgs_limit=pending_msgs_limit,
+                pending_bytes_limit=pending_bytes_limit
+            )
         logger.info(f"Subscribed to topic {topic}")
     except Exception as e:
         logger.error(f"Failed to subscribe to {topic}: {e}")
         raise
 
+def wants_reply(msg) -> bool:
+    """True when the message carries a genuine requester inbox.
+
+    JetStream-delivered messages put their $JS.ACK ack subject in
+    msg.reply; publishing a result there would be read by the server as
+    a positive ack (even for failures) and the requester would never
+    see it. Handlers gate their respond() calls on this instead of a
+    bare msg.reply check.
+    """
+    reply = getattr(msg, 'reply', None)
+    return bool(reply) and not reply.startswith('$JS.ACK')
+
+async def respond(msg, data: Dict[str, Any]):
+    """Serialize a reply payload and respond to a request message.
+
+    orjson emits bytes directly and renders datetimes natively, so
+    handlers can put naive UTC datetimes straight into result dicts.
+    """
+    await msg.respond(orjson.dumps(data, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC))
+
+async def subscribe_pull_batch(
+    topic: str,
+    handler: Callable,
+    durable: str,
+    batch_size: int = 64,
+    fetch_timeout: float = 1.0,
+    max_ack_pending: int = 256,
+    ack_wait: Optional[float] = None
+) -> asyncio.Task:
+    """Consume a JetStream subject with pull-based batch fetches.
+
+    Messages are fetched in batches, handled concurrently, then acked
+    together — amortizing the broker round trip across the batch instead
+    of paying a confirm per message. Returns the consumer task; callers
+    cancel it on shutdown.
+    """
+    if not jetstream:
+        raise RuntimeError("JetStream not initialized")
+
+    config = ConsumerConfig(max_ack_pending=max_ack_pending, ack_wait=ack_wait)
+    sub = await jetstream.pull_subscribe(topic, durable=durable, config=config)
+    logger.info(f"Pull subscription created for {topic} (durable={durable})")
+
+    async def _process(msg) -> bool:
+        try:
+            data = orjson.loads(msg.data)
+            await handler(data, msg)
+            return True
+        except Exception as e:
+            logger.error(f"Error handling message from {topic}: {e}")
+            return False
+
+    async def _consume():
+        while True:
+            try:
+                msgs = await sub.fetch(batch_size, timeout=fetch_timeout)
+            except (asyncio.TimeoutError, NATSTimeoutError):
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pull fetch failed for {topic}: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            handled = await asyncio.gather(*(_process(m) for m in msgs))
+            # Batch the acks so the whole fetch confirms in one flush;
+            # failed messages stay unacked and redeliver after ack_wait
+            await asyncio.gather(
+                *(m.ack() for m, ok in zip(msgs, handled) if ok),
+                return_exceptions=True
+            )
+
+    return asyncio.create_task(_consume())
+
 async def request_response(topic: str, data: Dict[str, Any], timeout: float = 5.0) -> Dict[str, Any]:
     """Send request and wait for response"""
     if not nats_client:
         raise RuntimeError("NATS client not initialized")
     
     try:
-        message = json.dumps(data).encode()
+        message = orjson.dumps(data)
         response = await nats_client.request(topic, message, timeout=timeout)
-        return json.loads(response.data.decode())
+        return orjson.loads(response.data)
     except Exception as e:
         logger.error(f"Failed to get response from {topic}: {e}")
         raise
@@ -5,22 +5,40 @@ Coach Worker - Just-in-time coaching and micro-lesson delivery
 import asyncio
 import logging
 from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
-import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
 
-from shared.database import get_async_session, get_redis_client
-from shared.message_bus import subscribe_to_topic, publish_message, TOPICS
+import orjson
+
+from shared.database import fetch_one_cached, get_async_session, get_redis_client
+from shared.message_bus import subscribe_to_topic, publish_message, respond, wants_reply, TOPICS
 from shared.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+class EventType(IntEnum):
+    """Coachable event types, used to index the template tuple"""
+    EMAIL_CLICKED = 0
+    SMS_CLICKED = 1
+    LANDING_VISITED = 2
+    LANDING_FORM_SUBMITTED = 3
+
+_EVENT_INDEX = {
+    'email_clicked': EventType.EMAIL_CLICKED,
+    'sms_clicked': EventType.SMS_CLICKED,
+    'landing_visited': EventType.LANDING_VISITED,
+    'landing_form_submitted': EventType.LANDING_FORM_SUBMITTED,
+}
+
 class CoachWorker:
     def __init__(self):
         self.settings = get_settings()
         self.is_running = False
         self.processed_count = 0
         self.error_count = 0
-        
+        self.redis = None
+
         # Coaching templates by event type
         self.coaching_templates = {
             'email_clicked': {
@@ -121,6 +139,17 @@ You submitted information on a simulated phishing page! This is a crucial learni
             }
         }
         
+        # Enum-indexed tuple for the per-event lookup: an O(1) array access
+        # with no string hashing on the hot path
+        self._templates = tuple(
+            self.coaching_templates[name] for name, _ in
+            sorted(_EVENT_INDEX.items(), key=lambda item: item[1])
+        )
+
+        # Notification previews are the first 200 chars of each template
+        # message; personalization only appends, so the prefix is stable
+        self._preview_cache = {k: v['message'][:200] + '...' for k, v in self.coaching_templates.items()}
+
         # Micro-lesson library
         self.micro_lessons = {
             'phishing_identification': {
@@ -152,7 +181,12 @@ You submitted information on a simulated phishing page! This is a crucial learni
     async def start(self):
         """Start the coach worker"""
         self.is_running = True
-        await subscribe_to_topic(TOPICS['coach_send'], self.handle_coaching_request, 'coach_workers')
+        # Cache the shared client so hot paths skip an accessor await per call
+        self.redis = get_redis_client()
+        await subscribe_to_topic(
+            TOPICS['coach_send'], self.handle_coaching_request, 'coach_workers',
+            use_jetstream=True
+        )
         logger.info("Coach worker started")
 
     async def stop(self):
@@ -175,8 +209,8 @@ You submitted information on a simulated phishing page! This is a crucial learni
                 raise ValueError(f"Unknown coaching request type: {request_type}")
             
             # Send response if reply_to is provided
-            if msg.reply:
-                await msg.respond(result)
+            if wants_reply(msg):
+                await respond(msg, result)
             
             self.processed_count += 1
             
@@ -184,8 +218,8 @@ You submitted information on a simulated phishing page! This is a crucial learni
             logger.error(f"Error handling coaching request: {e}")
             self.error_count += 1
             
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': False,
                     'error': str(e)
                 })
@@ -198,7 +232,8 @@ You submitted information on a simulated phishing page! This is a crucial learni
         org_id = data.get('org_id')
         
         # Get coaching template for event type
-        coaching_template = self.coaching_templates.get(event_type)
+        event_idx = _EVENT_INDEX.get(event_type)
+        coaching_template = self._templates[event_idx] if event_idx is not None else None
         if not coaching_template:
             return {
                 'success': False,
@@ -209,22 +244,28 @@ You submitted information on a simulated phishing page! This is a crucial learni
         personalized_coaching = await self._personalize_coaching(
             coaching_template, user_id, campaign_id, data.get('context', {})
         )
-        
-        # Store coaching session
-        coaching_session = await self._create_coaching_session(
-            user_id, org_id, campaign_id, event_type, personalized_coaching
-        )
-        
-        # Auto-assign relevant micro-lessons
-        assigned_lessons = []
-        for lesson_id in coaching_template.get('micro_lessons', []):
-            lesson_assignment = await self._assign_micro_lesson_to_user(
-                user_id, lesson_id, coaching_session['id']
+
+        # Batch all Redis writes for this event into a single pipeline
+        # so the session, lesson assignments, and notification are flushed
+        # in one network round trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # Store coaching session
+            coaching_session = await self._create_coaching_session(
+                user_id, org_id, campaign_id, event_type, personalized_coaching, pipe=pipe
             )
-            assigned_lessons.append(lesson_assignment)
-        
-        # Send coaching notification (this would integrate with frontend)
-        await self._send_coaching_notification(user_id, coaching_session)
+
+            # Auto-assign relevant micro-lessons
+            assigned_lessons = []
+            for lesson_id in coaching_template.get('micro_lessons', []):
+                lesson_assignment = await self._assign_micro_lesson_to_user(
+                    user_id, lesson_id, coaching_session['id'], pipe=pipe
+                )
+                assigned_lessons.append(lesson_assignment)
+
+            # Send coaching notification (this would integrate with frontend)
+            await self._send_coaching_notification(user_id, coaching_session, pipe=pipe)
+
+            await pipe.execute()
         
         return {
             'success': True,
@@ -261,10 +302,12 @@ You submitted information on a simulated phishing page! This is a crucial learni
             'micro_lessons': template['micro_lessons']
         }
 
-    async def _create_coaching_session(self, user_id: str, org_id: str, campaign_id: str, event_type: str, coaching_content: Dict[str, Any]) -> Dict[str, Any]:
+    async def _create_coaching_session(self, user_id: str, org_id: str, campaign_id: str, event_type: str, coaching_content: Dict[str, Any], pipe=None) -> Dict[str, Any]:
         """Create a coaching session record"""
-        session_id = f"coaching_{user_id}_{datetime.utcnow().timestamp()}"
-        
+        # uuid4 suffix is collision-safe under concurrency, unlike a
+        # wall-clock timestamp
+        session_id = f"coaching_{user_id}_{uuid.uuid4().hex}"
+
         session = {
             'id': session_id,
             'user_id': user_id,
@@ -273,32 +316,46 @@ You submitted information on a simulated phishing page! This is a crucial learni
             'event_type': event_type,
             'coaching_content': coaching_content,
             'status': 'active',
-            'created_at': datetime.utcnow(),
+            'created_at': datetime.now(timezone.utc),
             'completed_at': None
         }
         
-        # Store in Redis for quick access
-        redis = await get_redis_client()
-        await redis.setex(
-            f"coaching_session:{session_id}",
-            86400,  # 24 hours TTL
-            json.dumps(session, default=str)
-        )
-        
+        # Store in Redis for quick access; use the caller's pipeline when
+        # provided so the write is flushed with the rest of the event
+        if pipe is not None:
+            self._queue_session_writes(pipe, user_id, session_id, session)
+        else:
+            async with self.redis.pipeline(transaction=False) as own_pipe:
+                self._queue_session_writes(own_pipe, user_id, session_id, session)
+                await own_pipe.execute()
+
         # Also store in database for persistence
         # This would be implemented with actual database schema
-        logger.info(f"Coaching session created: {session_id}")
-        
+        logger.info("Coaching session created: %s", session_id)
+
         return session
 
-    async def _assign_micro_lesson_to_user(self, user_id: str, lesson_id: str, coaching_session_id: str) -> Dict[str, Any]:
+    def _queue_session_writes(self, pipe, user_id: str, session_id: str, session: Dict[str, Any]):
+        """Queue the Redis writes for a coaching session on a pipeline"""
+        pipe.setex(
+            f"coaching_session:{session_id}",
+            86400,  # 24 hours TTL
+            orjson.dumps(session, default=str)
+        )
+        # Index sessions per user in a sorted set scored by creation time
+        # so recent-history reads are a single ZRANGE
+        pipe.zadd(f"user:{user_id}:sessions", {session_id: session['created_at'].timestamp()})
+        pipe.expire(f"user:{user_id}:sessions", 86400)
+
+    async def _assign_micro_lesson_to_user(self, user_id: str, lesson_id: str, coaching_session_id: str, pipe=None) -> Dict[str, Any]:
         """Assign a micro-lesson to a user"""
         lesson = self.micro_lessons.get(lesson_id)
         if not lesson:
             raise ValueError(f"Unknown lesson ID: {lesson_id}")
         
-        assignment_id = f"assignment_{user_id}_{lesson_id}_{datetime.utcnow().timestamp()}"
-        
+        assignment_id = f"assignment_{user_id}_{lesson_id}_{uuid.uuid4().hex}"
+        now = datetime.now(timezone.utc)
+
         assignment = {
             'id': assignment_id,
             'user_id': user_id,
@@ -306,28 +363,37 @@ You submitted information on a simulated phishing page! This is a crucial learni
             'lesson_title': lesson['title'],
             'coaching_session_id': coaching_session_id,
             'status': 'assigned',
-            'assigned_at': datetime.utcnow(),
-            'due_date': datetime.utcnow() + timedelta(days=7),  # 7 days to complete
+            'assigned_at': now,
+            'due_date': now + timedelta(days=7),  # 7 days to complete
             'completed_at': None,
             'score': None
         }
         
-        # Store assignment
-        redis = await get_redis_client()
-        await redis.setex(
-            f"lesson_assignment:{assignment_id}",
-            604800,  # 7 days TTL
-            json.dumps(assignment, default=str)
-        )
-        
-        # Add to user's assignment list
-        await redis.sadd(f"user_assignments:{user_id}", assignment_id)
-        await redis.expire(f"user_assignments:{user_id}", 604800)
-        
-        logger.info(f"Micro-lesson assigned: {lesson_id} to user {user_id}")
+        # Store assignment and add to the user's assignment list in one
+        # pipeline round trip
+        if pipe is not None:
+            self._queue_assignment_writes(pipe, user_id, assignment_id, assignment)
+        else:
+            async with self.redis.pipeline(transaction=False) as own_pipe:
+                self._queue_assignment_writes(own_pipe, user_id, assignment_id, assignment)
+                await own_pipe.execute()
         
+        logger.info("Micro-lesson assigned: %s to user %s", lesson_id, user_id)
+
         return assignment
 
+    def _queue_assignment_writes(self, pipe, user_id: str, assignment_id: str, assignment: Dict[str, Any]):
+        """Queue the Redis writes for a lesson assignment on a pipeline"""
+        # One hash per user instead of a key per assignment: a single
+        # HGETALL reads everything back and small hashes stay in Redis's
+        # compact listpack encoding
+        pipe.hset(
+            f"user:{user_id}:assignments",
+            assignment_id,
+            orjson.dumps(assignment, default=str)
+        )
+        pipe.expire(f"user:{user_id}:assignments", 604800)  # 7 days TTL
+
     async def assign_micro_lesson(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Manually assign a micro-lesson to a user"""
         user_id = data.get('user_id')
@@ -368,7 +434,14 @@ You submitted information on a simulated phishing page! This is a crucial learni
 
     async def _get_user_info(self, user_id: str) -> Dict[str, Any]:
         """Get user information"""
-        # This would query the database for user details
+        try:
+            row = await fetch_one_cached(
+                "SELECT id, name, email FROM users WHERE id = $1", user_id
+            )
+            if row:
+                return dict(row)
+        except Exception as e:
+            logger.warning(f"User lookup failed for {user_id}: {e}")
         return {
             'id': user_id,
             'name': 'User Name',  # Placeholder
@@ -377,7 +450,14 @@ You submitted information on a simulated phishing page! This is a crucial learni
 
     async def _get_campaign_info(self, campaign_id: str) -> Dict[str, Any]:
         """Get campaign information"""
-        # This would query the database for campaign details
+        try:
+            row = await fetch_one_cached(
+                "SELECT id, name, type FROM campaigns WHERE id = $1", campaign_id
+            )
+            if row:
+                return dict(row)
+        except Exception as e:
+            logger.warning(f"Campaign lookup failed for {campaign_id}: {e}")
         return {
             'id': campaign_id,
             'name': 'Security Awareness Campaign',  # Placeholder
@@ -385,51 +465,56 @@ You submitted information on a simulated phishing page! This is a crucial learni
         }
 
     async def _get_user_coaching_history(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get user's coaching session history"""
-        redis = await get_redis_client()
-        
-        # Get all coaching sessions for user
-        # This is a simplified implementation
-        sessions = []
-        
-        # In a real implementation, this would query the database
-        logger.debug(f"Retrieved coaching history for user: {user_id}")
-        
-        return sessions
+        """Get user's coaching session history, oldest first"""
+        # Session ids live in a per-user sorted set scored by creation time
+        session_ids = await self.redis.zrange(f"user:{user_id}:sessions", 0, -1)
+        if not session_ids:
+            return []
+
+        keys = [f"coaching_session:{session_id}" for session_id in session_ids]
+        raw_sessions = await self.redis.mget(keys)
+
+        return [orjson.loads(raw) for raw in raw_sessions if raw]
 
     async def _get_user_lesson_assignments(self, user_id: str) -> List[Dict[str, Any]]:
         """Get user's lesson assignments"""
-        redis = await get_redis_client()
-        
-        # Get assignment IDs for user
-        assignment_ids = await redis.smembers(f"user_assignments:{user_id}")
-        
-        assignments = []
-        for assignment_id in assignment_ids:
-            assignment_data = await redis.get(f"lesson_assignment:{assignment_id}")
-            if assignment_data:
-                assignment = json.loads(assignment_data)
-                assignments.append(assignment)
-        
-        return assignments
+        # All assignments live in one per-user hash, so a single HGETALL
+        # replaces the old SMEMBERS + MGET pair
+        raw_assignments = await self.redis.hgetall(f"user:{user_id}:assignments")
+
+        return [orjson.loads(raw) for raw in raw_assignments.values()]
 
-    async def _send_coaching_notification(self, user_id: str, coaching_session: Dict[str, Any]):
+    async def _send_coaching_notification(self, user_id: str, coaching_session: Dict[str, Any], pipe=None):
         """Send coaching notification to user"""
         # This would integrate with the frontend notification system
         # For now, just log the notification
-        logger.info(f"Coaching notification sent to user {user_id}: {coaching_session['coaching_content']['title']}")
-        
+        logger.info(
+            "Coaching notification sent to user %s: %s",
+            user_id, coaching_session['coaching_content']['title']
+        )
+
         # Store notification for frontend to pick up
-        redis = await get_redis_client()
+        preview = self._preview_cache.get(coaching_session['event_type'])
+        if preview is None:
+            preview = coaching_session['coaching_content']['message'][:200] + '...'
         notification = {
             'type': 'coaching',
             'user_id': user_id,
             'title': coaching_session['coaching_content']['title'],
-            'message': coaching_session['coaching_content']['message'][:200] + '...',
+            'message': preview,
             'session_id': coaching_session['id'],
             'created_at': datetime.utcnow().isoformat()
         }
-        
-        await redis.lpush(f"notifications:{user_id}", json.dumps(notification))
-        await redis.ltrim(f"notifications:{user_id}", 0, 50)  # Keep last 50 notifications
-        await redis.expire(f"notifications:{user_id}", 86400)  # 24 hours TTL
+
+        if pipe is not None:
+            self._queue_notification_writes(pipe, user_id, notification)
+        else:
+            async with self.redis.pipeline(transaction=False) as own_pipe:
+                self._queue_notification_writes(own_pipe, user_id, notification)
+                await own_pipe.execute()
+
+    def _queue_notification_writes(self, pipe, user_id: str, notification: Dict[str, Any]):
+        """Queue the Redis writes for a notification on a pipeline"""
+        pipe.lpush(f"notifications:{user_id}", orjson.dumps(notification))
+        pipe.ltrim(f"notifications:{user_id}", 0, 50)  # Keep last 50 notifications
+        pipe.expire(f"notifications:{user_id}", 86400)  # 24 hours TTL
@@ -3,21 +3,36 @@ Delivery Worker - Multi-channel message delivery with throttling and compliance
 """
 
 import asyncio
+import itertools
 import logging
-import smtplib
+from collections import deque
+import re
+import time
+import aiosmtplib
 from email.mime.text import MimeText
 from email.mime.multipart import MimeMultipart
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+from urllib.parse import quote
+
 import aiohttp
-from twilio.rest import Client as TwilioClient
 
 from shared.database import get_async_session, get_redis_client
-from shared.message_bus import subscribe_to_topic, publish_message, TOPICS
+from shared.message_bus import subscribe_pull_batch, publish_message, respond, wants_reply, TOPICS
 from shared.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Compiled once; matching anchors for link-tracking rewrites
+_LINK_RE = re.compile(r'<a\s+href="([^"]+)"([^>]*)>')
+
+# Atomic INCR-with-window: one round trip and no read-modify-write race
+_RATE_LIMIT_LUA = """
+local n = redis.call('INCR', KEYS[1])
+if n == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+return n
+"""
+
 class DeliveryError(Exception):
     """Raised when delivery fails"""
     pass
@@ -29,27 +44,69 @@ class DeliverWorker:
         self.processed_count = 0
         self.error_count = 0
         
-        # Initialize service clients
+        # Twilio REST is called straight over aiohttp; keep the basic-auth
+        # header prebuilt when credentials are configured
         if self.settings.twilio_account_sid and self.settings.twilio_auth_token:
-            self.twilio_client = TwilioClient(
+            self._twilio_auth = aiohttp.BasicAuth(
                 self.settings.twilio_account_sid,
                 self.settings.twilio_auth_token
             )
+            self._twilio_messages_url = (
+                f"https://api.twilio.com/2010-04-01/Accounts/"
+                f"{self.settings.twilio_account_sid}/Messages.json"
+            )
         else:
-            self.twilio_client = None
+            self._twilio_auth = None
+            self._twilio_messages_url = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._rl_script = None
         
         # Rate limiting
         self.rate_limiter = {}
+        # Nanosecond clock plus a monotonic counter keeps tracking and
+        # simulation keys unique even for same-instant bursts
+        self._seq = itertools.count()
+        # Debug-only simulation writes buffer here and a background task
+        # flushes them, keeping Redis off the delivery response path
+        self._sim_buffer = deque()
+        self._flusher = None
+        self._consumer_task = None
+
+        # Tracking URL prefix resolved once from settings
+        self._track_base = self.settings.tracking_base_url.rstrip('/')
 
     async def start(self):
         """Start the delivery worker"""
         self.is_running = True
-        await subscribe_to_topic(TOPICS['deliver_send'], self.handle_delivery_request, 'deliver_workers')
+        # Pull-based batches: deliveries in a fetch are handled
+        # concurrently and acked together
+        # One pooled HTTP session for all providers: keep-alive reuse
+        # avoids a TCP+TLS handshake per message
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=200,
+                limit_per_host=50,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+        self._rl_script = get_redis_client().register_script(_RATE_LIMIT_LUA)
+        self._consumer_task = await subscribe_pull_batch(
+            TOPICS['deliver_send'], self.handle_delivery_request, 'deliver_workers'
+        )
+        self._flusher = asyncio.create_task(self._flush_sim_writes())
         logger.info("Delivery worker started")
 
     async def stop(self):
         """Stop the delivery worker"""
         self.is_running = False
+        if self._consumer_task:
+            self._consumer_task.cancel()
+        if self._flusher:
+            self._flusher.cancel()
+        if self._http:
+            await self._http.close()
         logger.info("Delivery worker stopped")
 
     async def handle_delivery_request(self, data: Dict[str, Any], msg):
@@ -72,8 +129,8 @@ class DeliverWorker:
             await self._log_delivery_attempt(data, result)
             
             # Send response if reply_to is provided
-            if msg.reply:
-                await msg.respond(result)
+            if wants_reply(msg):
+                await respond(msg, result)
             
             self.processed_count += 1
             
@@ -81,8 +138,8 @@ class DeliverWorker:
             logger.error(f"Error handling delivery request: {e}")
             self.error_count += 1
             
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': False,
                     'error': str(e)
                 })
@@ -98,14 +155,15 @@ class DeliverWorker:
         # Validate inputs
         if not all([recipient, subject, content]):
             raise DeliveryError("Missing required email fields")
-        
-        # Check rate limiting
+
+        # Rate limit before doing any per-message work, so rejected
+        # requests never pay for the tracking rewrite
         await self._check_rate_limit('email', recipient)
-        
+
         # Add tracking parameters
-        tracking_id = f"{campaign_id}_{recipient}_{datetime.utcnow().timestamp()}"
+        tracking_id = f"{campaign_id}_{recipient}_{time.time_ns()}_{next(self._seq)}"
         tracked_content = await self._add_email_tracking(content, tracking_id)
-        
+
         # Deliver via configured method
         if self.settings.sendgrid_api_key:
             result = await self._deliver_via_sendgrid(recipient, subject, tracked_content, sender)
@@ -113,40 +171,43 @@ class DeliverWorker:
             result = await self._deliver_via_smtp(recipient, subject, tracked_content, sender)
         else:
             # Simulation mode - don't actually send
-            result = await self._simulate_email_delivery(recipient, subject, tracked_content)
+            result = self._simulate_email_delivery(recipient, subject, tracked_content)
         
         return {
             'success': True,
             'delivery_id': tracking_id,
             'recipient': recipient,
-            'delivered_at': datetime.utcnow().isoformat(),
+            'delivered_at': datetime.utcnow(),
             'method': result.get('method', 'simulation')
         }
 
     async def _deliver_via_sendgrid(self, recipient: str, subject: str, content: str, sender: str) -> Dict[str, Any]:
-        """Deliver email via SendGrid"""
-        import sendgrid
-        from sendgrid.helpers.mail import Mail
-        
-        sg = sendgrid.SendGridAPIClient(api_key=self.settings.sendgrid_api_key)
-        
+        """Deliver email via SendGrid's REST API over the pooled HTTP session"""
         # Add safety watermark to subject
         safe_subject = f"[TRAINING SIMULATION] {subject}"
-        
-        message = Mail(
-            from_email=sender,
-            to_emails=recipient,
-            subject=safe_subject,
-            html_content=content
-        )
-        
+
+        payload = {
+            'personalizations': [{'to': [{'email': recipient}]}],
+            'from': {'email': sender},
+            'subject': safe_subject,
+            'content': [{'type': 'text/html', 'value': content}]
+        }
+
         try:
-            response = sg.send(message)
-            return {
-                'method': 'sendgrid',
-                'status_code': response.status_code,
-                'message_id': response.headers.get('X-Message-Id')
-            }
+            async with self._http.post(
+                'https://api.sendgrid.com/v3/mail/send',
+                headers={'Authorization': f'Bearer {self.settings.sendgrid_api_key}'},
+                json=payload
+            ) as response:
+                if response.status >= 400:
+                    raise DeliveryError(f"SendGrid returned {response.status}: {await response.text()}")
+                return {
+                    'method': 'sendgrid',
+                    'status_code': response.status,
+                    'message_id': response.headers.get('X-Message-Id')
+                }
+        except DeliveryError:
+            raise
         except Exception as e:
             raise DeliveryError(f"SendGrid delivery failed: {e}")
 
@@ -164,13 +225,18 @@ class DeliverWorker:
         msg.attach(html_part)
         
         try:
-            with smtplib.SMTP(self.settings.smtp_host, self.settings.smtp_port) as server:
-                if self.settings.smtp_username and self.settings.smtp_password:
-                    server.starttls()
-                    server.login(self.settings.smtp_username, self.settings.smtp_password)
-                
-                server.send_message(msg)
-            
+            # aiosmtplib keeps the TLS handshake and send off the event
+            # loop's back, so concurrent deliveries are not serialized
+            # behind one blocking SMTP conversation
+            await aiosmtplib.send(
+                msg,
+                hostname=self.settings.smtp_host,
+                port=self.settings.smtp_port,
+                start_tls=bool(self.settings.smtp_username and self.settings.smtp_password),
+                username=self.settings.smtp_username,
+                password=self.settings.smtp_password
+            )
+
             return {
                 'method': 'smtp',
                 'status': 'sent'
@@ -178,19 +244,16 @@ class DeliverWorker:
         except Exception as e:
             raise DeliveryError(f"SMTP delivery failed: {e}")
 
-    async def _simulate_email_delivery(self, recipient: str, subject: str, content: str) -> Dict[str, Any]:
+    def _simulate_email_delivery(self, recipient: str, subject: str, content: str) -> Dict[str, Any]:
         """Simulate email delivery for testing"""
         logger.info(f"SIMULATED EMAIL DELIVERY to {recipient}: {subject}")
-        
-        # Store in Redis for testing/debugging
-        redis = await get_redis_client()
-        simulation_key = f"simulated_email:{recipient}:{datetime.utcnow().timestamp()}"
-        await redis.setex(
-            simulation_key,
-            3600,  # 1 hour TTL
-            f"Subject: {subject}\nContent: {content[:200]}..."
-        )
-        
+
+        # Queue for the background flush; only the first 200 chars of
+        # content are kept to bound network bytes and Redis memory
+        simulation_key = f"simulated_email:{recipient}:{time.time_ns()}_{next(self._seq)}"
+        stored = f"Subject: {subject}\nContent: {content[:200]}..."
+        self._sim_buffer.append((simulation_key, 3600, stored))  # 1 hour TTL
+
         return {
             'method': 'simulation',
             'simulation_key': simulation_key
@@ -204,53 +267,60 @@ class DeliverWorker:
         
         if not all([recipient, content]):
             raise DeliveryError("Missing required SMS fields")
-        
-        # Check rate limiting
-        await self._check_rate_limit('sms', recipient)
-        
+
         # Add safety prefix
         safe_content = f"[TRAINING SIM] {content}"
-        
+
+        await self._check_rate_limit('sms', recipient)
+
         # Deliver via configured method
-        if self.twilio_client:
+        if self._twilio_auth:
             result = await self._deliver_via_twilio(recipient, safe_content)
         else:
-            result = await self._simulate_sms_delivery(recipient, safe_content)
+            result = self._simulate_sms_delivery(recipient, safe_content)
         
-        tracking_id = f"{campaign_id}_{recipient}_{datetime.utcnow().timestamp()}"
+        tracking_id = f"{campaign_id}_{recipient}_{time.time_ns()}_{next(self._seq)}"
         
         return {
             'success': True,
             'delivery_id': tracking_id,
             'recipient': recipient,
-            'delivered_at': datetime.utcnow().isoformat(),
+            'delivered_at': datetime.utcnow(),
             'method': result.get('method', 'simulation')
         }
 
     async def _deliver_via_twilio(self, recipient: str, content: str) -> Dict[str, Any]:
-        """Deliver SMS via Twilio"""
+        """Deliver SMS via Twilio's REST API over the pooled HTTP session"""
         try:
-            message = self.twilio_client.messages.create(
-                body=content,
-                from_='+1234567890',  # Configure your Twilio number
-                to=recipient
-            )
-            
+            async with self._http.post(
+                self._twilio_messages_url,
+                auth=self._twilio_auth,
+                data={
+                    'Body': content,
+                    'From': '+1234567890',  # Configure your Twilio number
+                    'To': recipient
+                }
+            ) as response:
+                body = await response.json()
+                if response.status >= 400:
+                    raise DeliveryError(f"Twilio returned {response.status}: {body.get('message')}")
+
             return {
                 'method': 'twilio',
-                'message_sid': message.sid,
-                'status': message.status
+                'message_sid': body.get('sid'),
+                'status': body.get('status')
             }
+        except DeliveryError:
+            raise
         except Exception as e:
             raise DeliveryError(f"Twilio delivery failed: {e}")
 
-    async def _simulate_sms_delivery(self, recipient: str, content: str) -> Dict[str, Any]:
+    def _simulate_sms_delivery(self, recipient: str, content: str) -> Dict[str, Any]:
         """Simulate SMS delivery for testing"""
         logger.info(f"SIMULATED SMS DELIVERY to {recipient}: {content}")
-        
-        redis = await get_redis_client()
-        simulation_key = f"simulated_sms:{recipient}:{datetime.utcnow().timestamp()}"
-        await redis.setex(simulation_key, 3600, content)
+
+        simulation_key = f"simulated_sms:{recipient}:{time.time_ns()}_{next(self._seq)}"
+        self._sim_buffer.append((simulation_key, 3600, content[:200]))
         
         return {
             'method': 'simulation',
@@ -270,13 +340,13 @@ class DeliverWorker:
         # In production, this would integrate with voice services
         logger.info(f"SIMULATED VOICE DELIVERY to {recipient}")
         
-        tracking_id = f"{campaign_id}_{recipient}_{datetime.utcnow().timestamp()}"
+        tracking_id = f"{campaign_id}_{recipient}_{time.time_ns()}_{next(self._seq)}"
         
         return {
             'success': True,
             'delivery_id': tracking_id,
             'recipient': recipient,
-            'delivered_at': datetime.utcnow().isoformat(),
+            'delivered_at': datetime.utcnow(),
             'method': 'simulation'
         }
 
@@ -300,42 +370,67 @@ class DeliverWorker:
         else:
             result = await self._simulate_chat_delivery(recipient, safe_content, platform)
         
-        tracking_id = f"{campaign_id}_{recipient}_{datetime.utcnow().timestamp()}"
+        tracking_id = f"{campaign_id}_{recipient}_{time.time_ns()}_{next(self._seq)}"
         
         return {
             'success': True,
             'delivery_id': tracking_id,
             'recipient': recipient,
-            'delivered_at': datetime.utcnow().isoformat(),
+            'delivered_at': datetime.utcnow(),
             'method': result.get('method', 'simulation'),
             'platform': platform
         }
 
     async def _deliver_via_slack(self, recipient: str, content: str) -> Dict[str, Any]:
-        """Deliver message via Slack"""
+        """Deliver message via Slack over the pooled HTTP session"""
         if not self.settings.slack_bot_token:
             return await self._simulate_chat_delivery(recipient, content, 'slack')
-        
-        # Slack API integration would go here
-        logger.info(f"SIMULATED SLACK DELIVERY to {recipient}: {content}")
-        return {'method': 'simulation'}
+
+        try:
+            async with self._http.post(
+                'https://slack.com/api/chat.postMessage',
+                headers={'Authorization': f'Bearer {self.settings.slack_bot_token}'},
+                json={'channel': recipient, 'text': content}
+            ) as response:
+                body = await response.json()
+                if response.status >= 400 or not body.get('ok'):
+                    raise DeliveryError(f"Slack returned {response.status}: {body.get('error')}")
+                return {
+                    'method': 'slack',
+                    'ts': body.get('ts')
+                }
+        except DeliveryError:
+            raise
+        except Exception as e:
+            raise DeliveryError(f"Slack delivery failed: {e}")
 
     async def _deliver_via_teams(self, recipient: str, content: str) -> Dict[str, Any]:
-        """Deliver message via Microsoft Teams"""
+        """Deliver message via Microsoft Teams over the pooled HTTP session"""
         if not self.settings.teams_webhook_url:
             return await self._simulate_chat_delivery(recipient, content, 'teams')
-        
-        # Teams webhook integration would go here
-        logger.info(f"SIMULATED TEAMS DELIVERY to {recipient}: {content}")
-        return {'method': 'simulation'}
+
+        try:
+            async with self._http.post(
+                self.settings.teams_webhook_url,
+                json={'text': content}
+            ) as response:
+                if response.status >= 400:
+                    raise DeliveryError(f"Teams returned {response.status}: {await response.text()}")
+                return {
+                    'method': 'teams',
+                    'status_code': response.status
+                }
+        except DeliveryError:
+            raise
+        except Exception as e:
+            raise DeliveryError(f"Teams delivery failed: {e}")
 
     async def _simulate_chat_delivery(self, recipient: str, content: str, platform: str) -> Dict[str, Any]:
         """Simulate chat delivery for testing"""
         logger.info(f"SIMULATED {platform.upper()} DELIVERY to {recipient}: {content}")
         
-        redis = await get_redis_client()
-        simulation_key = f"simulated_chat:{platform}:{recipient}:{datetime.utcnow().timestamp()}"
-        await redis.setex(simulation_key, 3600, content)
+        simulation_key = f"simulated_chat:{platform}:{recipient}:{time.time_ns()}_{next(self._seq)}"
+        self._sim_buffer.append((simulation_key, 3600, content[:200]))
         
         return {
             'method': 'simulation',
@@ -344,42 +439,48 @@ class DeliverWorker:
 
     async def _add_email_tracking(self, content: str, tracking_id: str) -> str:
         """Add tracking pixels and links to email content"""
-        tracking_pixel = f'<img src="http://localhost:3001/api/v1/track/open/{tracking_id}" width="1" height="1" style="display:none;">'
-        
-        # Add tracking to links
-        import re
-        link_pattern = r'<a\s+href="([^"]+)"([^>]*)>'
-        
-        def add_tracking_to_link(match):
-            url = match.group(1)
-            attrs = match.group(2)
-            tracked_url = f"http://localhost:3001/api/v1/track/click/{tracking_id}?url={url}"
-            return f'<a href="{tracked_url}"{attrs}>'
-        
-        tracked_content = re.sub(link_pattern, add_tracking_to_link, content)
-        tracked_content += tracking_pixel
-        
-        return tracked_content
+        tracking_pixel = f'<img src="{self._track_base}/open/{tracking_id}" width="1" height="1" style="display:none;">'
+
+        # Rewrite links through the click tracker; percent-encode the
+        # original URL so & and quotes inside it survive the round trip
+        click_base = f'{self._track_base}/click/{tracking_id}?url='
+        tracked_content = _LINK_RE.sub(
+            lambda m: f'<a href="{click_base}{quote(m.group(1), safe="")}"{m.group(2)}>',
+            content
+        )
+
+        return "".join((tracked_content, tracking_pixel))
+
+    async def _flush_sim_writes(self):
+        """Drain buffered simulation writes in one pipeline every 50ms"""
+        redis = get_redis_client()
+        while True:
+            await asyncio.sleep(0.05)
+            if not self._sim_buffer:
+                continue
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    while self._sim_buffer:
+                        key, ttl, value = self._sim_buffer.popleft()
+                        pipe.setex(key, ttl, value)
+                    await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush simulation writes: {e}")
 
     async def _check_rate_limit(self, delivery_type: str, recipient: str):
         """Check and enforce rate limiting"""
-        redis = await get_redis_client()
-        
-        # Rate limit key
         rate_key = f"rate_limit:{delivery_type}:{recipient}"
-        current_count = await redis.get(rate_key)
-        
-        if current_count and int(current_count) >= self.settings.delivery_rate_limit:
+        count = await self._rl_script(keys=[rate_key], args=[60])  # 1 minute window
+
+        if int(count) > self.settings.delivery_rate_limit:
             raise DeliveryError(f"Rate limit exceeded for {recipient}")
-        
-        # Increment counter
-        await redis.incr(rate_key)
-        await redis.expire(rate_key, 60)  # 1 minute window
 
     async def _log_delivery_attempt(self, data: Dict[str, Any], result: Dict[str, Any]):
         """Log delivery attempt to database"""
         try:
-            session = await get_async_session()
+            session = get_async_session()
             
             # Log to delivery_attempts table
             # This would be implemented with actual database schema
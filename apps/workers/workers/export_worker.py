@@ -4,23 +4,21 @@ Export Worker - Generate reports, board packs, and compliance exports
 
 import asyncio
 import logging
+import os
+import statistics
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+import csv
+import hashlib
 import json
 import io
-import base64
-from dataclasses import dataclass
-import pandas as pd
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-from shared.database import get_clickhouse_client, get_redis_client, get_async_session
-from shared.message_bus import subscribe_to_topic, publish_message, TOPICS
+import zipfile
+from dataclasses import dataclass, asdict
+import aioboto3
+import orjson
+from shared.database import ch_execute, get_redis_client, get_async_session
+from shared.message_bus import subscribe_to_topic, publish_message, respond, wants_reply, TOPICS
 from shared.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -35,6 +33,7 @@ class ExportRequest:
     format: str  # 'pdf', 'csv', 'json', 'scorm', 'xapi'
     template: str
     delivery_method: str  # 'download', 'email', 's3'
+    force_refresh: bool = False  # bypass the collected-data cache (audit exports)
 
 class ExportWorker:
     def __init__(self):
@@ -63,6 +62,19 @@ class ExportWorker:
             }
         }
 
+        # PDF builds run in separate processes; the semaphore keeps the
+        # number of queued renders bounded to the pool size
+        self._pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        self._pdf_sem = asyncio.Semaphore(os.cpu_count())
+
+        # Single-flight map: identical requests landing before the first
+        # finishes share its result instead of running twice
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Pending ClickHouse day-row loads awaiting the next batch flush
+        self._day_pending: List[tuple] = []
+        self._day_flush: Optional[asyncio.Task] = None
+
     async def start(self):
         """Start the export worker"""
         self.is_running = True
@@ -72,6 +84,9 @@ class ExportWorker:
     async def stop(self):
         """Stop the export worker"""
         self.is_running = False
+        if self._day_flush is not None:
+            self._day_flush.cancel()
+        self._pdf_pool.shutdown(wait=False, cancel_futures=True)
         logger.info("Export worker stopped")
 
     async def handle_export_request(self, data: Dict[str, Any], msg):
@@ -85,15 +100,16 @@ class ExportWorker:
                 filters=data.get('filters', {}),
                 format=data.get('format', 'pdf'),
                 template=data.get('template', 'executive_summary'),
-                delivery_method=data.get('delivery_method', 'download')
+                delivery_method=data.get('delivery_method', 'download'),
+                force_refresh=data.get('force_refresh', False)
             )
             
             # Generate the export
             result = await self.generate_export(export_request)
             
             # Send response if reply_to is provided
-            if msg.reply:
-                await msg.respond(result)
+            if wants_reply(msg):
+                await respond(msg, result)
             
             self.processed_count += 1
             
@@ -101,14 +117,38 @@ class ExportWorker:
             logger.error(f"Error handling export request: {e}")
             self.error_count += 1
             
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': False,
                     'error': str(e)
                 })
 
     async def generate_export(self, request: ExportRequest) -> Dict[str, Any]:
-        """Generate export based on request parameters"""
+        """Generate export, coalescing identical in-flight requests.
+
+        This covers the sub-second window before the Redis data cache is
+        populated; the map only holds currently-running jobs, so memory
+        stays bounded.
+        """
+        fp = json.dumps(asdict(request), sort_keys=True, default=str)
+        inflight = self._inflight.get(fp)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[fp] = future
+        try:
+            result = await self._generate_export(request)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(fp, None)
+
+    async def _generate_export(self, request: ExportRequest) -> Dict[str, Any]:
+        """Run the full collection, generation and delivery pipeline"""
         try:
             # Collect data for the export
             export_data = await self._collect_export_data(request)
@@ -147,25 +187,56 @@ class ExportWorker:
             }
 
     async def _collect_export_data(self, request: ExportRequest) -> Dict[str, Any]:
-        """Collect data needed for the export"""
-        clickhouse = get_clickhouse_client()
-        redis = await get_redis_client()
-        
+        """Collect data needed for the export.
+
+        Results cache in Redis for ten minutes keyed on the request
+        fingerprint, so back-to-back requests for the same board pack
+        are served without touching ClickHouse again.
+        """
+        redis = get_redis_client()
+        fingerprint = json.dumps({
+            'org_id': request.org_id,
+            'template': request.template,
+            'date_range': request.date_range,
+            'filters': request.filters
+        }, sort_keys=True, default=str)
+        cache_key = "export_data:" + hashlib.blake2b(fingerprint.encode(), digest_size=16).hexdigest()
+
+        if not request.force_refresh:
+            cached = await redis.get(cache_key)
+            if cached is not None:
+                data = json.loads(cached)
+                data['date_range'] = {
+                    k: datetime.fromisoformat(v) for k, v in data['date_range'].items()
+                }
+                return data
+
         # Date range setup
         start_date = datetime.fromisoformat(request.date_range.get('start', (datetime.utcnow() - timedelta(days=30)).isoformat()))
         end_date = datetime.fromisoformat(request.date_range.get('end', datetime.utcnow().isoformat()))
-        
-        data = {
-            'organization': await self._get_organization_data(request.org_id),
-            'date_range': {'start': start_date, 'end': end_date},
-            'campaigns': await self._get_campaign_data(request.org_id, start_date, end_date),
-            'users': await self._get_user_data(request.org_id, start_date, end_date),
-            'events': await self._get_event_data(request.org_id, start_date, end_date),
-            'training': await self._get_training_data(request.org_id, start_date, end_date),
-            'risk_scores': await self._get_risk_data(request.org_id),
-            'compliance': await self._get_compliance_data(request.org_id, start_date, end_date)
+
+        # The sources are independent, so fetch them concurrently; wall
+        # clock collapses to the slowest source instead of the sum of all
+        sources = {
+            'organization': self._get_organization_data(request.org_id),
+            'campaigns': self._get_campaign_data(request.org_id, start_date, end_date),
+            'users': self._get_user_data(request.org_id, start_date, end_date),
+            'events': self._get_event_data(request.org_id, start_date, end_date),
+            'training': self._get_training_data(request.org_id, start_date, end_date),
+            'risk_scores': self._get_risk_data(request.org_id),
+            'compliance': self._get_compliance_data(request.org_id, start_date, end_date)
         }
-        
+        results = await asyncio.gather(*sources.values(), return_exceptions=True)
+
+        data = {'date_range': {'start': start_date, 'end': end_date}}
+        for name, value in zip(sources, results):
+            if isinstance(value, Exception):
+                # One failing source degrades its section, not the report
+                logger.error(f"Failed to collect {name} data: {value}")
+                value = [] if name == 'campaigns' else {}
+            data[name] = value
+
+        await redis.setex(cache_key, 600, json.dumps(data, default=str))
         return data
 
     async def _get_organization_data(self, org_id: str) -> Dict[str, Any]:
@@ -179,47 +250,132 @@ class ExportWorker:
             'departments': ['IT', 'Finance', 'HR', 'Sales', 'Marketing']
         }
 
+    # Daily per-campaign counters from the campaign_stats materialized
+    # view; one row per (campaign, day) rather than one per event.
+    # Keyed by (org_id, date) pairs so one query can serve several
+    # batched callers at once
+    _CAMPAIGN_DAY_QUERY = """
+    SELECT
+        org_id,
+        campaign_id,
+        date,
+        sum(event_count) as total_events,
+        sumIf(event_count, event_type = 'email_sent') as sent_count,
+        sumIf(event_count, event_type = 'email_opened') as opened_count,
+        sumIf(event_count, event_type = 'email_clicked') as clicked_count,
+        sumIf(event_count, event_type = 'email_reported') as reported_count
+    FROM ai_defense_events.campaign_stats
+    WHERE (org_id, date) IN %(pairs)s
+    GROUP BY org_id, campaign_id, date
+    SETTINGS max_threads = 4, optimize_aggregation_in_order = 1
+    """
+
+    async def _load_campaign_days(self, org_id: str, days: List) -> Dict[Any, List]:
+        """Fetch day rows from ClickHouse through a short debounce window.
+
+        Concurrent exports (different templates, overlapping windows,
+        even different orgs) land in the same pending list and share a
+        single query instead of each issuing their own — the DataLoader
+        pattern, trading 20 ms of latency for one query per burst.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._day_pending.append((org_id, days, future))
+        if self._day_flush is None or self._day_flush.done():
+            self._day_flush = asyncio.create_task(self._flush_day_loads())
+        # Bounded wait so a lost flush degrades to an error, not a hang
+        return await asyncio.wait_for(future, timeout=30)
+
+    async def _flush_day_loads(self):
+        await asyncio.sleep(0.02)
+        pending, self._day_pending = self._day_pending, []
+        try:
+            pairs = sorted({(org_id, day) for org_id, days, _ in pending for day in days})
+            try:
+                results = await ch_execute(self._CAMPAIGN_DAY_QUERY, {'pairs': pairs})
+            except Exception as e:
+                for _, _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            rows: Dict[tuple, List] = {}
+            for org_id, campaign_id, day, *counts in results:
+                rows.setdefault((org_id, day), []).append([str(campaign_id), *counts])
+            for org_id, days, future in pending:
+                if not future.done():
+                    future.set_result({day: rows.get((org_id, day), []) for day in days})
+        finally:
+            # A caller that enqueued after the swap above saw a task that
+            # wasn't done() and scheduled nothing; pick its batch up here
+            # so no future is left unresolved
+            if self._day_pending:
+                self._day_flush = asyncio.create_task(self._flush_day_loads())
+
     async def _get_campaign_data(self, org_id: str, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
-        """Get campaign performance data"""
-        clickhouse = get_clickhouse_client()
-        
-        query = """
-        SELECT 
-            campaign_id,
-            COUNT(*) as total_events,
-            SUM(CASE WHEN event_type = 'email_sent' THEN 1 ELSE 0 END) as sent_count,
-            SUM(CASE WHEN event_type = 'email_opened' THEN 1 ELSE 0 END) as opened_count,
-            SUM(CASE WHEN event_type = 'email_clicked' THEN 1 ELSE 0 END) as clicked_count,
-            SUM(CASE WHEN event_type = 'email_reported' THEN 1 ELSE 0 END) as reported_count
-        FROM ai_defense_events.events 
-        WHERE org_id = %(org_id)s 
-        AND timestamp BETWEEN %(start_date)s AND %(end_date)s
-        GROUP BY campaign_id
+        """Get campaign performance data.
+
+        Per-day counter rows cache in Redis: overlapping report windows
+        (last-30-days today vs. tomorrow) share 29 of 30 days, so
+        ClickHouse only sees the days nobody has asked about yet.
+        Finished days never change and keep a week-long TTL; today stays
+        short-lived. The counters are additive, so merging a window is
+        plain arithmetic and the rates derive at the end.
         """
-        
+        redis = get_redis_client()
+        days = [
+            start_date.date() + timedelta(days=i)
+            for i in range((end_date.date() - start_date.date()).days + 1)
+        ]
+        today = datetime.utcnow().date()
+
         try:
-            results = clickhouse.execute(query, {
-                'org_id': org_id,
-                'start_date': start_date,
-                'end_date': end_date
-            })
-            
-            campaigns = []
-            for row in results:
-                campaign_id, total_events, sent, opened, clicked, reported = row
-                campaigns.append({
+            cached = await redis.mget([f"ch_agg:{org_id}:campaigns:{d.isoformat()}" for d in days])
+            day_rows = {}
+            missing = []
+            for day, raw in zip(days, cached):
+                if raw is not None:
+                    day_rows[day] = orjson.loads(raw)
+                else:
+                    missing.append(day)
+
+            if missing:
+                fetched = await self._load_campaign_days(org_id, missing)
+
+                async with redis.pipeline(transaction=False) as pipe:
+                    for day, rows in fetched.items():
+                        pipe.setex(
+                            f"ch_agg:{org_id}:campaigns:{day.isoformat()}",
+                            600 if day >= today else 604800,
+                            orjson.dumps(rows)
+                        )
+                    await pipe.execute()
+                day_rows.update(fetched)
+
+            # Merge the additive counters across days
+            totals: Dict[str, List[int]] = {}
+            for rows in day_rows.values():
+                for campaign_id, *counts in rows:
+                    agg = totals.get(campaign_id)
+                    if agg is None:
+                        totals[campaign_id] = list(counts)
+                    else:
+                        for i, value in enumerate(counts):
+                            agg[i] += value
+
+            return [
+                {
                     'id': campaign_id,
-                    'total_events': total_events,
+                    'total_events': total,
                     'sent_count': sent,
                     'opened_count': opened,
                     'clicked_count': clicked,
                     'reported_count': reported,
                     'click_rate': (clicked / sent * 100) if sent > 0 else 0,
                     'report_rate': (reported / sent * 100) if sent > 0 else 0
-                })
-            
-            return campaigns
-            
+                }
+                for campaign_id, (total, sent, opened, clicked, reported) in totals.items()
+            ]
+
         except Exception as e:
             logger.error(f"Failed to get campaign data: {e}")
             return []
@@ -275,12 +431,21 @@ class ExportWorker:
 
     async def _get_risk_data(self, org_id: str) -> Dict[str, Any]:
         """Get risk scoring data"""
-        redis = await get_redis_client()
-        
-        # Get risk scores from Redis
-        risk_scores = await redis.zrevrange(f"org_risk_scores:{org_id}", 0, -1, withscores=True)
-        
-        if not risk_scores:
+        redis = get_redis_client()
+
+        # Classify server-side with ZCOUNT instead of shipping the whole
+        # sorted set over the wire; the average comes from the running
+        # sum the risk worker maintains alongside the set
+        key = f"org_risk_scores:{org_id}"
+        high, medium, low, total, score_sum = await asyncio.gather(
+            redis.zcount(key, 75, '+inf'),
+            redis.zcount(key, 50, '(75'),
+            redis.zcount(key, '-inf', '(50'),
+            redis.zcard(key),
+            redis.get(f"org_risk_sum:{org_id}")
+        )
+
+        if not total:
             # Mock risk data
             return {
                 'average_risk_score': 35.2,
@@ -295,15 +460,11 @@ class ExportWorker:
                 ]
             }
         
-        # Process actual risk scores
-        scores = [float(score) for _, score in risk_scores]
-        avg_score = sum(scores) / len(scores) if scores else 0
-        
         return {
-            'average_risk_score': avg_score,
-            'high_risk_users': len([s for s in scores if s >= 75]),
-            'medium_risk_users': len([s for s in scores if 50 <= s < 75]),
-            'low_risk_users': len([s for s in scores if s < 50]),
+            'average_risk_score': float(score_sum) / total if score_sum else 0,
+            'high_risk_users': high,
+            'medium_risk_users': medium,
+            'low_risk_users': low,
             'risk_trend': 'stable'  # Would calculate trend from historical data
         }
 
@@ -323,150 +484,57 @@ class ExportWorker:
         }
 
     async def _generate_pdf_report(self, request: ExportRequest, data: Dict[str, Any]) -> bytes:
-        """Generate PDF report"""
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.HexColor('#1f2937')
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.HexColor('#374151')
-        )
-        
-        # Title
+        """Generate PDF report.
+
+        ReportLab is pure-Python and CPU-bound; building in a process
+        pool keeps the event loop free for other export requests and
+        lets multiple PDFs render on separate cores. The semaphore
+        bounds queued jobs to the pool size.
+        """
+        # Deferred import: ReportLab only loads on the first PDF request
+        from workers.pdf_report import build_pdf
+
         template = self.report_templates.get(request.template, self.report_templates['executive_summary'])
-        story.append(Paragraph(template['title'], title_style))
-        story.append(Spacer(1, 20))
-        
-        # Organization info
-        story.append(Paragraph(f"Organization: {data['organization']['name']}", styles['Normal']))
-        story.append(Paragraph(f"Report Period: {data['date_range']['start'].strftime('%Y-%m-%d')} to {data['date_range']['end'].strftime('%Y-%m-%d')}", styles['Normal']))
-        story.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC", styles['Normal']))
-        story.append(Spacer(1, 30))
-        
-        # Executive Summary
-        if 'overview' in template['sections'] or 'executive_summary' in template['sections']:
-            story.append(Paragraph("Executive Summary", heading_style))
-            
-            summary_data = [
-                ['Metric', 'Value', 'Status'],
-                ['Total Users', str(data['organization']['total_users']), '✓'],
-                ['Training Completion', f"{data['training']['completion_rate']:.1f}%", '✓' if data['training']['completion_rate'] >= 80 else '⚠'],
-                ['Average Risk Score', f"{data['risk_scores']['average_risk_score']:.1f}", '✓' if data['risk_scores']['average_risk_score'] < 50 else '⚠'],
-                ['High Risk Users', str(data['risk_scores']['high_risk_users']), '⚠' if data['risk_scores']['high_risk_users'] > 50 else '✓']
-            ]
-            
-            summary_table = Table(summary_data)
-            summary_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#1f2937')),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e5e7eb'))
-            ]))
-            
-            story.append(summary_table)
-            story.append(Spacer(1, 20))
-        
-        # Key Metrics
-        if 'key_metrics' in template['sections'] or 'program_metrics' in template['sections']:
-            story.append(Paragraph("Key Metrics", heading_style))
-            
-            metrics_data = [
-                ['Campaign Metrics', 'Value'],
-                ['Total Campaigns', str(len(data['campaigns']))],
-                ['Emails Sent', str(data['events']['emails_sent'])],
-                ['Click Rate', f"{sum(c['click_rate'] for c in data['campaigns']) / len(data['campaigns']):.1f}%" if data['campaigns'] else "0%"],
-                ['Report Rate', f"{sum(c['report_rate'] for c in data['campaigns']) / len(data['campaigns']):.1f}%" if data['campaigns'] else "0%"],
-                ['Training Completed', str(data['training']['completed_lessons'])],
-                ['Certifications Issued', str(data['training']['certifications_issued'])]
-            ]
-            
-            metrics_table = Table(metrics_data)
-            metrics_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#1f2937')),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e5e7eb'))
-            ]))
-            
-            story.append(metrics_table)
-            story.append(Spacer(1, 20))
-        
-        # Risk Assessment
-        if 'risk_assessment' in template['sections'] or 'risk_trends' in template['sections']:
-            story.append(Paragraph("Risk Assessment", heading_style))
-            
-            risk_text = f"""
-            Current average risk score: {data['risk_scores']['average_risk_score']:.1f}/100
-            
-            Risk Distribution:
-            • Low Risk Users: {data['risk_scores']['low_risk_users']} ({data['risk_scores']['low_risk_users']/data['organization']['total_users']*100:.1f}%)
-            • Medium Risk Users: {data['risk_scores']['medium_risk_users']} ({data['risk_scores']['medium_risk_users']/data['organization']['total_users']*100:.1f}%)
-            • High Risk Users: {data['risk_scores']['high_risk_users']} ({data['risk_scores']['high_risk_users']/data['organization']['total_users']*100:.1f}%)
-            
-            Risk Trend: {data['risk_scores']['risk_trend'].title()}
-            """
-            
-            story.append(Paragraph(risk_text, styles['Normal']))
-            story.append(Spacer(1, 20))
-        
-        # Recommendations
-        if 'recommendations' in template['sections'] or 'action_items' in template['sections']:
-            story.append(Paragraph("Recommendations", heading_style))
-            
-            recommendations = self._generate_recommendations(data)
-            for i, rec in enumerate(recommendations, 1):
-                story.append(Paragraph(f"{i}. {rec}", styles['Normal']))
-            
-            story.append(Spacer(1, 20))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
+        recommendations = self._generate_recommendations(data)
+        async with self._pdf_sem:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pdf_pool, build_pdf, template, data, recommendations
+            )
+
+    @staticmethod
+    def _rows_to_csv(rows: List[Dict[str, Any]]) -> str:
+        """Serialize dict rows with the stdlib csv module.
+
+        The exports here are small enough that pandas' DataFrame
+        construction and dtype inference cost more than the write itself.
+        """
+        if not rows:
+            return ""
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+        return buf.getvalue()
 
     async def _generate_csv_export(self, request: ExportRequest, data: Dict[str, Any]) -> str:
         """Generate CSV export"""
         if request.export_type == 'campaign_data':
             # Campaign performance CSV
-            df = pd.DataFrame(data['campaigns'])
-            return df.to_csv(index=False)
-        
+            return self._rows_to_csv(data['campaigns'])
+
         elif request.export_type == 'user_data':
             # User performance CSV
-            user_data = []
-            for dept, info in data['users']['departments'].items():
-                user_data.append({
+            user_data = [
+                {
                     'Department': dept,
                     'Total Users': info['users'],
                     'Average Score': info['avg_score'],
                     'High Risk Users': info['high_risk']
-                })
-            
-            df = pd.DataFrame(user_data)
-            return df.to_csv(index=False)
-        
+                }
+                for dept, info in data['users']['departments'].items()
+            ]
+            return self._rows_to_csv(user_data)
+
         else:
             # General metrics CSV
             metrics_data = [
@@ -478,11 +546,9 @@ class ExportWorker:
                 {'Metric': 'Emails Clicked', 'Value': data['events']['emails_clicked']},
                 {'Metric': 'Emails Reported', 'Value': data['events']['emails_reported']}
             ]
-            
-            df = pd.DataFrame(metrics_data)
-            return df.to_csv(index=False)
+            return self._rows_to_csv(metrics_data)
 
-    async def _generate_json_export(self, request: ExportRequest, data: Dict[str, Any]) -> str:
+    async def _generate_json_export(self, request: ExportRequest, data: Dict[str, Any]) -> bytes:
         """Generate JSON export"""
         export_data = {
             'export_info': {
@@ -497,8 +563,14 @@ class ExportWorker:
             },
             'data': data
         }
-        
-        return json.dumps(export_data, indent=2, default=str)
+
+        # orjson serializes straight to bytes in C (datetimes included),
+        # and the download path wants bytes anyway - no decode round trip
+        return orjson.dumps(
+            export_data,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NAIVE_UTC,
+            default=str
+        )
 
     async def _generate_scorm_package(self, request: ExportRequest, data: Dict[str, Any]) -> bytes:
         """Generate SCORM 1.2 package"""
@@ -531,17 +603,38 @@ class ExportWorker:
   </resources>
 </manifest>"""
         
-        # In a real implementation, this would create a proper ZIP file
-        return manifest_xml.encode('utf-8')
+        lesson_html = """<!DOCTYPE html>
+<html>
+<head><title>Phishing Identification</title></head>
+<body>
+<h1>Phishing Identification</h1>
+<p>Interactive lesson content for {org_id} training.</p>
+</body>
+</html>""".format(org_id=request.org_id)
+
+        # Assemble the package in memory: XML/HTML deflate well at low
+        # effort, while already-compressed media assets go in stored so
+        # no CPU is wasted re-deflating them
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+            z.writestr('imsmanifest.xml', manifest_xml)
+            z.writestr('lesson1.html', lesson_html)
+            for asset_name, asset_bytes in data.get('scorm_assets', []):
+                z.writestr(asset_name, asset_bytes, compress_type=zipfile.ZIP_STORED)
 
-    async def _generate_xapi_package(self, request: ExportRequest, data: Dict[str, Any]) -> str:
+        return buf.getvalue()
+
+    async def _generate_xapi_package(self, request: ExportRequest, data: Dict[str, Any]) -> bytes:
         """Generate xAPI (Tin Can API) statements"""
-        statements = []
-        
-        # Generate xAPI statements for training completions
-        for i in range(data['training']['completed_lessons']):
-            statement = {
-                "id": f"statement_{i}_{datetime.utcnow().timestamp()}",
+        # Snapshot the clock once; calling utcnow() twice per statement
+        # added two datetime allocations for every completed lesson
+        now = datetime.utcnow()
+        now_ts = now.timestamp()
+        now_iso = now.isoformat() + "Z"
+
+        statements = [
+            {
+                "id": f"statement_{i}_{now_ts}",
                 "actor": {
                     "mbox": f"mailto:user{i}@{request.org_id}.com",
                     "name": f"User {i}"
@@ -567,11 +660,12 @@ class ExportWorker:
                     "success": True,
                     "completion": True
                 },
-                "timestamp": datetime.utcnow().isoformat() + "Z"
+                "timestamp": now_iso
             }
-            statements.append(statement)
-        
-        return json.dumps(statements, indent=2)
+            for i in range(data['training']['completed_lessons'])
+        ]
+
+        return orjson.dumps(statements, option=orjson.OPT_INDENT_2)
 
     def _generate_recommendations(self, data: Dict[str, Any]) -> List[str]:
         """Generate actionable recommendations based on data"""
@@ -587,36 +681,66 @@ class ExportWorker:
         
         # Campaign effectiveness recommendations
         if data['campaigns']:
-            avg_click_rate = sum(c['click_rate'] for c in data['campaigns']) / len(data['campaigns'])
+            # fmean is a single C-level pass over the rates
+            avg_click_rate = statistics.fmean(c['click_rate'] for c in data['campaigns'])
             if avg_click_rate > 15:
                 recommendations.append("Review and enhance phishing simulation difficulty to improve user awareness")
-        
+
         # Compliance recommendations
         if data['compliance']['training_compliance'] < 90:
             recommendations.append("Strengthen compliance tracking and reporting mechanisms")
-        
+
         # Department-specific recommendations
-        for dept, info in data['users']['departments'].items():
-            if info['high_risk'] > info['users'] * 0.15:
-                recommendations.append(f"Focus additional security training resources on {dept} department")
+        recommendations.extend(
+            f"Focus additional security training resources on {dept} department"
+            for dept, info in data['users']['departments'].items()
+            if info['high_risk'] > info['users'] * 0.15
+        )
         
         return recommendations[:5]  # Limit to top 5 recommendations
 
+    _MIME_TYPES = {
+        'pdf': 'application/pdf',
+        'csv': 'text/csv',
+        'json': 'application/json',
+        'scorm': 'application/zip',
+        'xapi': 'application/json'
+    }
+
     async def _handle_delivery(self, request: ExportRequest, export_file: bytes) -> Dict[str, Any]:
         """Handle export delivery based on method"""
         if request.delivery_method == 'download':
-            # Store in Redis for download
-            redis = await get_redis_client()
-            download_key = f"export_download:{request.org_id}:{datetime.utcnow().timestamp()}"
-            
-            # Store file data (base64 encoded for Redis)
-            file_data = base64.b64encode(export_file).decode('utf-8') if isinstance(export_file, bytes) else export_file
-            
-            await redis.setex(download_key, 3600, file_data)  # 1 hour TTL
-            
+            # Multi-MB report bytes go to object storage where they
+            # belong; Redis only keeps the small pre-signed URL record
+            download_key = f"exports/{request.org_id}/export_{datetime.utcnow().timestamp()}.{request.format}"
+            body = export_file if isinstance(export_file, bytes) else str(export_file).encode('utf-8')
+
+            session = aioboto3.Session()
+            async with session.client(
+                's3',
+                endpoint_url=self.settings.s3_endpoint,
+                aws_access_key_id=self.settings.s3_access_key,
+                aws_secret_access_key=self.settings.s3_secret_key,
+                region_name=self.settings.s3_region
+            ) as s3:
+                await s3.put_object(
+                    Bucket=self.settings.s3_bucket,
+                    Key=download_key,
+                    Body=body,
+                    ContentType=self._MIME_TYPES.get(request.format, 'application/octet-stream')
+                )
+                url = await s3.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': self.settings.s3_bucket, 'Key': download_key},
+                    ExpiresIn=3600
+                )
+
+            # The response itself carries the pre-signed URL and expiry;
+            # no separate Redis record is needed (or reachable) for it
             return {
                 'method': 'download',
                 'download_key': download_key,
+                'url': url,
                 'expires_at': (datetime.utcnow() + timedelta(hours=1)).isoformat()
             }
         
@@ -642,11 +766,11 @@ class ExportWorker:
 
     async def get_export_status(self, export_id: str) -> Dict[str, Any]:
         """Get status of an export job"""
-        redis = await get_redis_client()
+        redis = get_redis_client()
         
         status_data = await redis.get(f"export_status:{export_id}")
         if status_data:
-            return json.loads(status_data)
+            return orjson.loads(status_data)
         
         return {
             'export_id': export_id,
@@ -7,15 +7,48 @@ import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 import json
-import statistics
+import time
+from bisect import bisect_right
+from collections import deque
 from dataclasses import dataclass
 
-from shared.database import get_async_session, get_redis_client, get_clickhouse_client
-from shared.message_bus import subscribe_to_topic, publish_message, TOPICS
+import numpy as np
+import orjson
+
+from shared.database import get_async_session, get_redis_client, ch_execute, ch_insert
+from shared.message_bus import subscribe_to_topic, publish_message, respond, wants_reply, TOPICS
 from shared.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Risk records carry naive UTC datetimes and (via the vectorized cohort
+# path) NumPy scalars; orjson handles both natively
+_ORJSON_OPTS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+
+# Atomic single-user store: write the record hash, then touch the org
+# ZSET and running sum only when the score actually moved. One
+# round-trip and no read-modify-write race between the ZSCORE and the
+# update.
+# KEYS: user record hash, org ZSET, org running sum
+# ARGV: user_id, record TTL, new score, epsilon, field/value pairs...
+_STORE_RISK_LUA = """
+local old = redis.call('ZSCORE', KEYS[2], ARGV[1])
+local score = tonumber(ARGV[3])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if old then
+    if math.abs(tonumber(old) - score) > tonumber(ARGV[4]) then
+        redis.call('ZADD', KEYS[2], score, ARGV[1])
+        redis.call('INCRBYFLOAT', KEYS[3], score - tonumber(old))
+    end
+else
+    redis.call('ZADD', KEYS[2], score, ARGV[1])
+    redis.call('INCRBYFLOAT', KEYS[3], score)
+end
+return 1
+"""
+
 @dataclass
 class RiskScore:
     user_id: str
@@ -56,6 +89,14 @@ class RiskWorker:
             'time_to_report': 0.10,       # How quickly they report suspicious content
             'repeat_offender': 0.05       # Multiple clicks in short timeframe
         }
+
+        # Fixed factor order and matching weights vector, built once so
+        # the scoring paths do array math instead of per-factor dict
+        # lookups
+        self._factor_order = ('click_rate', 'report_rate', 'training_completion',
+                              'recent_incidents', 'time_to_report', 'repeat_offender')
+        self._weights_vec = np.array([self.risk_weights[k] for k in self._factor_order],
+                                     dtype=np.float64)
         
         # Risk level thresholds
         self.risk_thresholds = {
@@ -65,6 +106,45 @@ class RiskWorker:
             'critical': 90
         }
 
+        # Sorted bins and labels derived from the thresholds; level
+        # lookup becomes an index instead of a comparison cascade, and
+        # the cohort path reuses the same bins for its digitize
+        self._level_bins = (self.risk_thresholds['medium'],
+                            self.risk_thresholds['high'],
+                            self.risk_thresholds['critical'])
+        self._level_labels = ('low', 'medium', 'high', 'critical')
+
+        # Short-lived in-process cache in front of Redis for read paths
+        # hit in bursts (recommendation lookups, campaign triggers):
+        # within the TTL, repeat calls skip the Redis round-trip entirely
+        self._local_cache: Dict[str, tuple] = {}
+
+        # Scores awaiting the batched ClickHouse insert
+        self._ch_buffer: deque = deque()
+        self._ch_flusher: Optional[asyncio.Task] = None
+
+        # Bound in start() once the shared client exists; storage and
+        # lookup paths reuse the handle instead of re-resolving it per
+        # call
+        self.redis = None
+        self._store_script = None
+
+    _LOCAL_CACHE_TTL = 30.0
+    _LOCAL_CACHE_MAX = 4096
+
+    def _local_get(self, key: str) -> Optional[Any]:
+        entry = self._local_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                return entry[1]
+            del self._local_cache[key]
+        return None
+
+    def _local_set(self, key: str, value: Any):
+        if len(self._local_cache) >= self._LOCAL_CACHE_MAX:
+            self._local_cache.clear()
+        self._local_cache[key] = (time.monotonic() + self._LOCAL_CACHE_TTL, value)
+
     async def start(self):
         """Start the risk worker"""
         self.is_running = True
@@ -72,12 +152,20 @@ class RiskWorker:
         
         # Start periodic risk calculation
         asyncio.create_task(self.periodic_risk_calculation())
-        
+
+        # Background flusher for the batched risk_scores inserts
+        self._ch_flusher = asyncio.create_task(self._flush_risk_rows())
+
+        self.redis = get_redis_client()
+        self._store_script = self.redis.register_script(_STORE_RISK_LUA)
+
         logger.info("Risk worker started")
 
     async def stop(self):
         """Stop the risk worker"""
         self.is_running = False
+        if self._ch_flusher is not None:
+            self._ch_flusher.cancel()
         logger.info("Risk worker stopped")
 
     async def handle_risk_request(self, data: Dict[str, Any], msg):
@@ -97,8 +185,8 @@ class RiskWorker:
                 raise ValueError(f"Unknown risk request type: {request_type}")
             
             # Send response if reply_to is provided
-            if msg.reply:
-                await msg.respond(result)
+            if wants_reply(msg):
+                await respond(msg, result)
             
             self.processed_count += 1
             
@@ -106,8 +194,8 @@ class RiskWorker:
             logger.error(f"Error handling risk request: {e}")
             self.error_count += 1
             
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': False,
                     'error': str(e)
                 })
@@ -121,19 +209,42 @@ class RiskWorker:
             raise ValueError("user_id and org_id are required")
         
         # Get user's historical data
-        user_metrics = await self._get_user_metrics(user_id, org_id)
-        
+        # One wall-clock read per scoring pass
+        now = datetime.utcnow()
+        user_metrics = await self._get_user_metrics(user_id, org_id, now)
+
+        # Score from the fetched metrics
+        risk_score = self._score_user(user_id, org_id, user_metrics, now)
+
+        # Store risk score
+        await self._store_user_risk_score(risk_score)
+
+        # Check if adaptive action is needed
+        if risk_score.risk_level in ['high', 'critical']:
+            await self._trigger_adaptive_actions(risk_score)
+
+        return {
+            'success': True,
+            'user_id': user_id,
+            'risk_score': risk_score.overall_score,
+            'risk_level': risk_score.risk_level,
+            'factors': risk_score.factors,
+            'recommendations': self._generate_user_recommendations(risk_score)
+        }
+
+    def _score_user(self, user_id: str, org_id: str, metrics: Dict[str, Any],
+                          now: datetime) -> RiskScore:
+        """Build a RiskScore for one user from already-fetched metrics"""
         # Calculate individual risk factors
-        risk_factors = await self._calculate_risk_factors(user_id, org_id, user_metrics)
-        
+        risk_factors = self._calculate_risk_factors(user_id, org_id, metrics)
+
         # Calculate overall risk score
         overall_score = self._calculate_weighted_risk_score(risk_factors)
-        
+
         # Determine risk level
         risk_level = self._determine_risk_level(overall_score)
-        
-        # Create risk score object
-        risk_score = RiskScore(
+
+        return RiskScore(
             user_id=user_id,
             org_id=org_id,
             overall_score=overall_score,
@@ -142,25 +253,52 @@ class RiskWorker:
             training_completion_rate=risk_factors.get('training_completion', 0),
             recent_incidents=risk_factors.get('recent_incidents', 0),
             risk_level=risk_level,
-            last_updated=datetime.utcnow(),
+            last_updated=now,
             factors=risk_factors
         )
-        
-        # Store risk score
-        await self._store_user_risk_score(risk_score)
-        
-        # Check if adaptive action is needed
-        if risk_level in ['high', 'critical']:
-            await self._trigger_adaptive_actions(risk_score)
-        
-        return {
-            'success': True,
-            'user_id': user_id,
-            'risk_score': overall_score,
-            'risk_level': risk_level,
-            'factors': risk_factors,
-            'recommendations': self._generate_user_recommendations(risk_score)
-        }
+
+    def _score_cohort(self, user_ids: List[str], org_id: str,
+                            metrics_by_user: Dict[str, Dict[str, Any]],
+                            now: datetime) -> List[RiskScore]:
+        """Score a whole cohort with one vectorized pass.
+
+        The factor matrix is (N_users, N_factors); normalization,
+        weighting and clamping run as NumPy array ops instead of a
+        Python loop per user.
+        """
+        if not user_ids:
+            return []
+
+        factor_dicts = [
+            self._calculate_risk_factors(user_id, org_id, metrics_by_user.get(user_id, {}))
+            for user_id in user_ids
+        ]
+        factors = np.array(
+            [[fd[k] for k in self._factor_order] for fd in factor_dicts],
+            dtype=np.float64
+        )
+        scores = np.clip(np.clip(factors, 0, 100) @ self._weights_vec, 0, 100)
+
+        # Bucket all levels at once instead of running the threshold
+        # lookup per user
+        levels = self._level_labels
+        level_idx = np.digitize(scores, self._level_bins)
+
+        return [
+            RiskScore(
+                user_id=user_id,
+                org_id=org_id,
+                overall_score=float(score),
+                click_rate=fd.get('click_rate', 0),
+                report_rate=fd.get('report_rate', 0),
+                training_completion_rate=fd.get('training_completion', 0),
+                recent_incidents=fd.get('recent_incidents', 0),
+                risk_level=levels[idx],
+                last_updated=now,
+                factors=fd
+            )
+            for user_id, fd, score, idx in zip(user_ids, factor_dicts, scores, level_idx)
+        ]
 
     async def calculate_cohort_risk(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Calculate risk metrics for a user cohort"""
@@ -170,18 +308,39 @@ class RiskWorker:
         
         if not cohort_id or not org_id:
             raise ValueError("cohort_id and org_id are required")
-        
-        # Calculate risk for all users in cohort
-        user_risk_scores = []
-        for user_id in user_ids:
-            try:
-                user_risk = await self.calculate_user_risk({
-                    'user_id': user_id,
-                    'org_id': org_id
-                })
-                user_risk_scores.append(user_risk['risk_score'])
-            except Exception as e:
-                logger.warning(f"Failed to calculate risk for user {user_id}: {e}")
+
+        # Callers that only need aggregates over already-scored users
+        # can skip the rescoring entirely: one ClickHouse query returns
+        # the average, the high-risk count and the risky-user list
+        if data.get('use_stored') and user_ids:
+            stored = await self._cohort_risk_from_stored(cohort_id, org_id, user_ids)
+            if stored is not None:
+                return stored
+
+        # One wall-clock read for the whole pass
+        now = datetime.utcnow()
+
+        # One ClickHouse round-trip for the whole cohort, then score all
+        # users in a single vectorized pass over the bucketed results
+        metrics_by_user = await self._get_cohort_metrics(user_ids, org_id, now)
+
+        if metrics_by_user is None:
+            # Batch query unavailable: score per user with bounded
+            # concurrency instead of stalling serially on each query
+            user_risk_scores = await self._calculate_cohort_fallback(user_ids, org_id)
+        else:
+            risk_scores = self._score_cohort(user_ids, org_id, metrics_by_user, now)
+
+            # One pipelined write for the whole cohort
+            await self._store_user_risk_scores_bulk(risk_scores)
+
+            user_risk_scores = [rs.overall_score for rs in risk_scores]
+            for risk_score in risk_scores:
+                if risk_score.risk_level in ['high', 'critical']:
+                    try:
+                        await self._trigger_adaptive_actions(risk_score)
+                    except Exception as e:
+                        logger.warning(f"Failed adaptive actions for user {risk_score.user_id}: {e}")
         
         if not user_risk_scores:
             return {
@@ -189,9 +348,11 @@ class RiskWorker:
                 'error': 'No valid user risk scores calculated'
             }
         
-        # Calculate cohort metrics
-        average_risk = statistics.mean(user_risk_scores)
-        high_risk_users = len([score for score in user_risk_scores if score >= self.risk_thresholds['high']])
+        # Calculate cohort metrics; the threshold count reduces as a
+        # vectorized mask sum instead of a Python-level filter
+        scores_arr = np.asarray(user_risk_scores, dtype=np.float64)
+        average_risk = float(scores_arr.mean())
+        high_risk_users = int((scores_arr >= self.risk_thresholds['high']).sum())
         
         # Determine risk trend
         risk_trend = await self._calculate_risk_trend(cohort_id, org_id, average_risk)
@@ -210,7 +371,7 @@ class RiskWorker:
             total_users=len(user_ids),
             risk_trend=risk_trend,
             recommended_actions=recommendations,
-            last_updated=datetime.utcnow()
+            last_updated=now
         )
         
         # Store cohort risk
@@ -226,105 +387,212 @@ class RiskWorker:
             'recommendations': recommendations
         }
 
-    async def _get_user_metrics(self, user_id: str, org_id: str) -> Dict[str, Any]:
-        """Get user's historical security metrics"""
-        clickhouse = get_clickhouse_client()
-        
-        # Query user's event history from ClickHouse
-        query = """
-        SELECT 
-            event_type,
-            COUNT(*) as count,
-            MIN(timestamp) as first_event,
-            MAX(timestamp) as last_event
-        FROM ai_defense_events.events 
-        WHERE user_id = %(user_id)s 
-        AND org_id = %(org_id)s 
-        AND timestamp >= %(start_date)s
-        GROUP BY event_type
+    # Cohort aggregates straight from the persisted scores: four
+    # scalars and the risky-user array in one round-trip, no per-user
+    # work in the worker
+    _COHORT_AGGREGATE_QUERY = """
+    SELECT
+        avg(overall_score) as avg_risk,
+        countIf(overall_score >= %(high)s) as high_risk,
+        count() as total,
+        groupArrayIf(user_id, overall_score >= %(high)s) as high_risk_ids
+    FROM ai_defense_events.risk_scores FINAL
+    WHERE org_id = %(org_id)s AND user_id IN %(user_ids)s
+    """
+
+    async def _cohort_risk_from_stored(self, cohort_id: str, org_id: str,
+                                       user_ids: List[str]) -> Optional[Dict[str, Any]]:
+        """Aggregate a cohort from persisted scores in one query.
+
+        Returns None when no stored scores cover the cohort, in which
+        case the caller falls back to a full rescoring pass.
         """
-        
-        start_date = datetime.utcnow() - timedelta(days=90)  # Last 90 days
-        
         try:
-            results = clickhouse.execute(query, {
+            results = await ch_execute(self._COHORT_AGGREGATE_QUERY, {
+                'org_id': org_id,
+                'user_ids': user_ids,
+                'high': self.risk_thresholds['high']
+            })
+        except Exception as e:
+            logger.error(f"Failed to aggregate stored cohort risk: {e}")
+            return None
+
+        avg_risk, high_risk, total, high_risk_ids = results[0]
+        if not total:
+            return None
+
+        average_risk = float(avg_risk)
+        high_risk_users = int(high_risk)
+
+        risk_trend = await self._calculate_risk_trend(cohort_id, org_id, average_risk)
+        recommendations = self._generate_cohort_recommendations(
+            average_risk, high_risk_users, len(user_ids), risk_trend
+        )
+
+        await self._store_cohort_risk(CohortRisk(
+            cohort_id=cohort_id,
+            org_id=org_id,
+            average_risk_score=average_risk,
+            high_risk_users=high_risk_users,
+            total_users=len(user_ids),
+            risk_trend=risk_trend,
+            recommended_actions=recommendations,
+            last_updated=datetime.utcnow()
+        ))
+
+        return {
+            'success': True,
+            'cohort_id': cohort_id,
+            'average_risk_score': average_risk,
+            'high_risk_users': high_risk_users,
+            'high_risk_user_ids': [str(uid) for uid in high_risk_ids],
+            'total_users': len(user_ids),
+            'risk_trend': risk_trend,
+            'recommendations': recommendations
+        }
+
+    _COHORT_FALLBACK_CONCURRENCY = 16
+
+    async def _calculate_cohort_fallback(self, user_ids: List[str], org_id: str) -> List[float]:
+        """Score cohort members individually with bounded concurrency.
+
+        Used when the batched cohort query fails; overlapping the
+        per-user queries keeps wall-clock at N / concurrency instead
+        of one serial round-trip per member.
+        """
+        sem = asyncio.Semaphore(self._COHORT_FALLBACK_CONCURRENCY)
+
+        async def score_one(user_id: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.calculate_user_risk({'user_id': user_id, 'org_id': org_id})
+
+        results = await asyncio.gather(*(score_one(u) for u in user_ids), return_exceptions=True)
+
+        user_risk_scores = []
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to calculate risk for user {user_id}: {result}")
+            else:
+                user_risk_scores.append(result['risk_score'])
+
+        return user_risk_scores
+
+    # The counters the scoring needs, computed server-side with
+    # conditional aggregates: ClickHouse returns six numbers per user
+    # instead of a row per event type, and PREWHERE prunes on the
+    # primary-key columns before the timestamp column is read
+    _METRIC_COLUMNS = (
+        'sent', 'clicked', 'reported',
+        'training_started', 'training_completed',
+        'total_incidents', 'recent_incidents'
+    )
+
+    _METRIC_AGGREGATES = """
+        countIf(event_type IN ('email_sent', 'sms_sent')) as sent,
+        countIf(event_type IN ('email_clicked', 'sms_clicked')) as clicked,
+        countIf(event_type IN ('email_reported', 'sms_reported')) as reported,
+        countIf(event_type = 'training_started') as training_started,
+        countIf(event_type = 'training_completed') as training_completed,
+        countIf(event_type IN ('email_clicked', 'sms_clicked', 'landing_form_submitted')) as total_incidents,
+        countIf(event_type IN ('email_clicked', 'sms_clicked', 'landing_form_submitted')
+                AND timestamp >= %(recent_cutoff)s) as recent_incidents
+    """
+
+    _USER_METRICS_QUERY = f"""
+    SELECT
+        {_METRIC_AGGREGATES}
+    FROM ai_defense_events.events
+    PREWHERE org_id = %(org_id)s AND user_id = %(user_id)s
+    WHERE timestamp >= %(start_date)s
+    """
+
+    async def _get_user_metrics(self, user_id: str, org_id: str, now: datetime) -> Dict[str, Any]:
+        """Get user's historical security metrics"""
+        try:
+            results = await ch_execute(self._USER_METRICS_QUERY, {
                 'user_id': user_id,
                 'org_id': org_id,
-                'start_date': start_date
+                'start_date': now - timedelta(days=90),
+                'recent_cutoff': now - timedelta(days=30)
             })
-            
-            metrics = {}
-            for row in results:
-                event_type, count, first_event, last_event = row
-                metrics[event_type] = {
-                    'count': count,
-                    'first_event': first_event,
-                    'last_event': last_event
-                }
-            
-            return metrics
-            
+
+            return dict(zip(self._METRIC_COLUMNS, results[0])) if results else {}
+
         except Exception as e:
             logger.error(f"Failed to get user metrics: {e}")
             return {}
 
-    async def _calculate_risk_factors(self, user_id: str, org_id: str, metrics: Dict[str, Any]) -> Dict[str, float]:
-        """Calculate individual risk factors for a user"""
+    # Same aggregation as _USER_METRICS_QUERY but grouped by user:
+    # scoring a cohort of N users costs one round-trip instead of N
+    _COHORT_METRICS_QUERY = f"""
+    SELECT
+        user_id,
+        {_METRIC_AGGREGATES}
+    FROM ai_defense_events.events
+    PREWHERE org_id = %(org_id)s AND user_id IN %(user_ids)s
+    WHERE timestamp >= %(start_date)s
+    GROUP BY user_id
+    """
+
+    async def _get_cohort_metrics(self, user_ids: List[str], org_id: str,
+                                  now: datetime) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Get historical metrics for a whole cohort in one query.
+
+        Returns None when the query fails, so callers can distinguish
+        "batch path unavailable" from "cohort has no events".
+        """
+        metrics_by_user: Dict[str, Dict[str, Any]] = {}
+
+        try:
+            results = await ch_execute(self._COHORT_METRICS_QUERY, {
+                'org_id': org_id,
+                'user_ids': user_ids,
+                'start_date': now - timedelta(days=90),
+                'recent_cutoff': now - timedelta(days=30)
+            })
+
+            for user_id, *counters in results:
+                metrics_by_user[user_id] = dict(zip(self._METRIC_COLUMNS, counters))
+
+        except Exception as e:
+            logger.error(f"Failed to get cohort metrics: {e}")
+            return None
+
+        return metrics_by_user
+
+    def _calculate_risk_factors(self, user_id: str, org_id: str, metrics: Dict[str, Any]) -> Dict[str, float]:
+        """Calculate individual risk factors from the aggregated counters"""
         factors = {}
-        
-        # Calculate click rate
-        total_sent = metrics.get('email_sent', {}).get('count', 0) + \
-                    metrics.get('sms_sent', {}).get('count', 0)
-        total_clicked = metrics.get('email_clicked', {}).get('count', 0) + \
-                      metrics.get('sms_clicked', {}).get('count', 0)
-        
-        factors['click_rate'] = (total_clicked / total_sent * 100) if total_sent > 0 else 0
-        
-        # Calculate report rate
-        total_reported = metrics.get('email_reported', {}).get('count', 0) + \
-                        metrics.get('sms_reported', {}).get('count', 0)
-        
-        factors['report_rate'] = (total_reported / total_sent * 100) if total_sent > 0 else 0
-        
+
+        # Click and report rates
+        total_sent = metrics.get('sent', 0)
+        factors['click_rate'] = (metrics.get('clicked', 0) / total_sent * 100) if total_sent > 0 else 0
+        factors['report_rate'] = (metrics.get('reported', 0) / total_sent * 100) if total_sent > 0 else 0
+
         # Training completion rate
-        training_started = metrics.get('training_started', {}).get('count', 0)
-        training_completed = metrics.get('training_completed', {}).get('count', 0)
-        
-        factors['training_completion'] = (training_completed / training_started * 100) if training_started > 0 else 0
-        
-        # Recent incidents (last 30 days)
-        recent_cutoff = datetime.utcnow() - timedelta(days=30)
-        recent_incidents = 0
-        
-        for event_type in ['email_clicked', 'sms_clicked', 'landing_form_submitted']:
-            if event_type in metrics:
-                last_event = metrics[event_type].get('last_event')
-                if last_event and last_event >= recent_cutoff:
-                    recent_incidents += metrics[event_type]['count']
-        
-        factors['recent_incidents'] = recent_incidents
-        
+        training_started = metrics.get('training_started', 0)
+        factors['training_completion'] = (metrics.get('training_completed', 0) / training_started * 100) if training_started > 0 else 0
+
+        # Incident-derived factors come from the same counters in one
+        # pass: recent incidents directly, repeat offender from the
+        # 90-day total
+        factors['recent_incidents'] = metrics.get('recent_incidents', 0)
+        factors['repeat_offender'] = self._repeat_offender_from_counts(metrics.get('total_incidents', 0))
+
         # Time to report (average time between click and report)
-        factors['time_to_report'] = await self._calculate_time_to_report(user_id, org_id)
-        
-        # Repeat offender factor
-        factors['repeat_offender'] = await self._calculate_repeat_offender_score(user_id, org_id, metrics)
-        
+        factors['time_to_report'] = self._calculate_time_to_report(user_id, org_id)
+
         return factors
 
-    async def _calculate_time_to_report(self, user_id: str, org_id: str) -> float:
+    def _calculate_time_to_report(self, user_id: str, org_id: str) -> float:
         """Calculate average time between suspicious activity and reporting"""
         # This would analyze the time difference between clicks and reports
         # For now, return a default value
         return 50.0  # Neutral score
 
-    async def _calculate_repeat_offender_score(self, user_id: str, org_id: str, metrics: Dict[str, Any]) -> float:
+    @staticmethod
+    def _repeat_offender_from_counts(total_incidents: int) -> float:
         """Calculate score based on repeated security incidents"""
-        total_incidents = 0
-        for event_type in ['email_clicked', 'sms_clicked', 'landing_form_submitted']:
-            if event_type in metrics:
-                total_incidents += metrics[event_type]['count']
-        
         # Score increases with number of incidents
         if total_incidents >= 5:
             return 100.0  # High risk
@@ -337,36 +605,25 @@ class RiskWorker:
 
     def _calculate_weighted_risk_score(self, factors: Dict[str, float]) -> float:
         """Calculate overall weighted risk score"""
-        total_score = 0.0
-        
-        for factor, value in factors.items():
-            weight = self.risk_weights.get(factor, 0)
-            
-            # Normalize values to 0-100 scale if needed
-            normalized_value = min(max(value, 0), 100)
-            
-            total_score += normalized_value * weight
-        
-        # Ensure score is between 0 and 100
-        return min(max(total_score, 0), 100)
+        vec = np.array([factors.get(k, 0.0) for k in self._factor_order], dtype=np.float64)
+
+        # Normalize to 0-100, weight, and clamp the result to 0-100
+        return float(np.clip(np.clip(vec, 0, 100) @ self._weights_vec, 0, 100))
 
     def _determine_risk_level(self, score: float) -> str:
         """Determine risk level based on score"""
-        if score >= self.risk_thresholds['critical']:
-            return 'critical'
-        elif score >= self.risk_thresholds['high']:
-            return 'high'
-        elif score >= self.risk_thresholds['medium']:
-            return 'medium'
-        else:
-            return 'low'
+        return self._level_labels[bisect_right(self._level_bins, score)]
 
-    async def _store_user_risk_score(self, risk_score: RiskScore):
-        """Store user risk score in Redis and database"""
-        redis = await get_redis_client()
-        
-        # Store in Redis for quick access
-        risk_data = {
+    @staticmethod
+    def _risk_record(risk_score: RiskScore) -> Dict[str, Any]:
+        """Build the Redis hash record for a user risk score.
+
+        Scalars are stored as individual hash fields so score-only
+        readers can HMGET overall_score/risk_level without decoding the
+        whole record; the factor breakdown stays packed as JSON for the
+        rarer deep reads.
+        """
+        return {
             'user_id': risk_score.user_id,
             'org_id': risk_score.org_id,
             'overall_score': risk_score.overall_score,
@@ -376,24 +633,108 @@ class RiskWorker:
             'training_completion_rate': risk_score.training_completion_rate,
             'recent_incidents': risk_score.recent_incidents,
             'last_updated': risk_score.last_updated.isoformat(),
-            'factors': risk_score.factors
+            'factors': orjson.dumps(risk_score.factors, option=_ORJSON_OPTS)
         }
-        
-        await redis.setex(
-            f"user_risk:{risk_score.user_id}",
-            86400,  # 24 hours TTL
-            json.dumps(risk_data, default=str)
+
+    def _buffer_risk_rows(self, risk_scores: List[RiskScore]):
+        """Queue scores for the batched ClickHouse risk_scores insert"""
+        self._ch_buffer.extend(
+            {
+                'org_id': rs.org_id,
+                'user_id': rs.user_id,
+                'overall_score': rs.overall_score,
+                'risk_level': rs.risk_level,
+                'last_updated': rs.last_updated
+            }
+            for rs in risk_scores
         )
-        
-        # Also store in organization-level risk tracking
-        await redis.zadd(
-            f"org_risk_scores:{risk_score.org_id}",
-            {risk_score.user_id: risk_score.overall_score}
+
+    async def _flush_risk_rows(self):
+        """Insert buffered risk scores into ClickHouse in batches"""
+        while True:
+            await asyncio.sleep(1.0)
+            if not self._ch_buffer:
+                continue
+
+            rows = []
+            while self._ch_buffer:
+                rows.append(self._ch_buffer.popleft())
+
+            try:
+                await ch_insert(
+                    'ai_defense_events.risk_scores',
+                    rows,
+                    ['org_id', 'user_id', 'overall_score', 'risk_level', 'last_updated']
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush {len(rows)} risk scores to ClickHouse: {e}")
+
+    async def _store_user_risk_scores_bulk(self, risk_scores: List[RiskScore]):
+        """Store a batch of risk scores for one org in a single pipeline.
+
+        A cohort write costs one ZMSCORE (for the running-sum deltas)
+        plus one pipelined round-trip, instead of the 2N the per-user
+        path would issue.
+        """
+        if not risk_scores:
+            return
+
+        redis = self.redis or get_redis_client()
+        org_id = risk_scores[0].org_id
+        org_key = f"org_risk_scores:{org_id}"
+
+        old_scores = await redis.zmscore(org_key, [rs.user_id for rs in risk_scores])
+        sum_delta = sum(
+            rs.overall_score - (old or 0.0)
+            for rs, old in zip(risk_scores, old_scores)
+        )
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for rs in risk_scores:
+                record_key = f"user_risk:{rs.user_id}"
+                pipe.delete(record_key)
+                pipe.hset(record_key, mapping=self._risk_record(rs))
+                pipe.expire(record_key, 86400)  # 24 hours TTL
+            pipe.zadd(org_key, {rs.user_id: rs.overall_score for rs in risk_scores})
+            pipe.incrbyfloat(f"org_risk_sum:{org_id}", sum_delta)
+            await pipe.execute()
+
+        self._buffer_risk_rows(risk_scores)
+
+    async def _store_user_risk_score(self, risk_score: RiskScore):
+        """Store user risk score in Redis and database.
+
+        The Lua script writes the record, updates the org ZSET and
+        keeps the running sum in step in one atomic round-trip — and
+        skips the ZSET/sum writes entirely when the score is unchanged,
+        the common case on steady-state recomputation.
+        """
+        if self._store_script is None:
+            self.redis = get_redis_client()
+            self._store_script = self.redis.register_script(_STORE_RISK_LUA)
+
+        await self._store_script(
+            keys=[
+                f"user_risk:{risk_score.user_id}",
+                f"org_risk_scores:{risk_score.org_id}",
+                f"org_risk_sum:{risk_score.org_id}"
+            ],
+            args=[
+                risk_score.user_id,
+                86400,  # 24 hours TTL
+                risk_score.overall_score,
+                0.001,  # epsilon: scores closer than this count as unchanged
+                *[part for item in self._risk_record(risk_score).items() for part in item]
+            ]
         )
 
+        self._buffer_risk_rows([risk_score])
+
     async def _store_cohort_risk(self, cohort_risk: CohortRisk):
         """Store cohort risk assessment"""
-        redis = await get_redis_client()
+        redis = self.redis or get_redis_client()
         
         cohort_data = {
             'cohort_id': cohort_risk.cohort_id,
@@ -403,13 +744,13 @@ class RiskWorker:
             'total_users': cohort_risk.total_users,
             'risk_trend': cohort_risk.risk_trend,
             'recommended_actions': cohort_risk.recommended_actions,
-            'last_updated': cohort_risk.last_updated.isoformat()
+            'last_updated': cohort_risk.last_updated
         }
-        
+
         await redis.setex(
             f"cohort_risk:{cohort_risk.cohort_id}",
             86400,  # 24 hours TTL
-            json.dumps(cohort_data, default=str)
+            orjson.dumps(cohort_data, option=_ORJSON_OPTS)
         )
 
     async def _trigger_adaptive_actions(self, risk_score: RiskScore):
@@ -442,7 +783,7 @@ class RiskWorker:
             'org_id': risk_score.org_id,
             'risk_score': risk_score.overall_score,
             'risk_level': risk_score.risk_level,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': risk_score.last_updated.isoformat()
         }
         
         if action == 'immediate_additional_training':
@@ -465,7 +806,7 @@ class RiskWorker:
         
         elif action == 'enhanced_monitoring':
             # Enable enhanced monitoring for this user
-            redis = await get_redis_client()
+            redis = self.redis or get_redis_client()
             await redis.setex(
                 f"enhanced_monitoring:{risk_score.user_id}",
                 604800,  # 7 days
@@ -526,21 +867,34 @@ class RiskWorker:
             "Review user's access permissions if necessary"
         ]
 
+    # Weekly org-level averages from the persisted risk_scores table;
+    # FINAL collapses ReplacingMergeTree rows to the latest per user
+    _RISK_TREND_QUERY = """
+    SELECT
+        toStartOfWeek(last_updated) as week,
+        avg(overall_score) as avg_score
+    FROM ai_defense_events.risk_scores FINAL
+    WHERE org_id = %(org_id)s
+    GROUP BY week
+    ORDER BY week DESC
+    LIMIT 5
+    """
+
     async def _calculate_risk_trend(self, cohort_id: str, org_id: str, current_avg: float) -> str:
-        """Calculate risk trend for a cohort"""
-        redis = await get_redis_client()
-        
-        # Get historical risk scores
-        historical_key = f"cohort_risk_history:{cohort_id}"
-        history = await redis.lrange(historical_key, 0, 4)  # Last 5 data points
-        
+        """Calculate risk trend from persisted weekly averages"""
+        try:
+            history = await ch_execute(self._RISK_TREND_QUERY, {'org_id': org_id})
+        except Exception as e:
+            logger.error(f"Failed to get risk trend history: {e}")
+            return 'stable'
+
         if len(history) < 2:
             return 'stable'  # Not enough data
-        
-        # Calculate trend
-        scores = [float(score) for score in history]
+
+        # Oldest first, with the current average as the latest point
+        scores = [float(avg_score) for _, avg_score in reversed(history)]
         scores.append(current_avg)
-        
+
         # Simple trend calculation
         if len(scores) >= 3:
             recent_trend = scores[-1] - scores[-3]
@@ -548,41 +902,100 @@ class RiskWorker:
                 return 'improving'
             elif recent_trend > 5:
                 return 'declining'
-        
+
         return 'stable'
 
+    # Orgs with any event in the scoring window
+    _ACTIVE_ORGS_QUERY = """
+    SELECT DISTINCT org_id
+    FROM ai_defense_events.events
+    WHERE timestamp >= %(start_date)s
+    """
+
+    # Whole-org sweep: every active user's counters in one aggregation
+    _ORG_METRICS_QUERY = f"""
+    SELECT
+        user_id,
+        {_METRIC_AGGREGATES}
+    FROM ai_defense_events.events
+    PREWHERE org_id = %(org_id)s
+    WHERE timestamp >= %(start_date)s
+    GROUP BY user_id
+    """
+
+    _SWEEP_STORE_BATCH = 10000
+
     async def periodic_risk_calculation(self):
         """Periodically recalculate risk scores for all users"""
         while self.is_running:
             try:
                 logger.info("Starting periodic risk calculation")
-                
-                # Get all active organizations
-                # This would query the database for active orgs
-                # For now, we'll skip the actual implementation
-                
+                await self._recalculate_all_orgs()
                 await asyncio.sleep(3600)  # Run every hour
-                
+
             except Exception as e:
                 logger.error(f"Error in periodic risk calculation: {e}")
                 await asyncio.sleep(300)  # Wait 5 minutes before retry
 
+    async def _recalculate_all_orgs(self):
+        """Recompute every active user's risk, one query per org.
+
+        Each org costs a single ClickHouse aggregation grouped by user,
+        a vectorized scoring pass and pipelined Redis writes in batches
+        of _SWEEP_STORE_BATCH — never one query or round-trip per user.
+        """
+        now = datetime.utcnow()
+        start_date = now - timedelta(days=90)
+
+        orgs = await ch_execute(self._ACTIVE_ORGS_QUERY, {'start_date': start_date})
+
+        for (org_id,) in orgs:
+            org_id = str(org_id)
+            try:
+                results = await ch_execute(self._ORG_METRICS_QUERY, {
+                    'org_id': org_id,
+                    'start_date': start_date,
+                    'recent_cutoff': now - timedelta(days=30)
+                }, settings={'max_block_size': 65536})
+
+                metrics_by_user = {
+                    str(user_id): dict(zip(self._METRIC_COLUMNS, counters))
+                    for user_id, *counters in results
+                }
+                user_ids = list(metrics_by_user)
+                risk_scores = self._score_cohort(user_ids, org_id, metrics_by_user, now)
+
+                for i in range(0, len(risk_scores), self._SWEEP_STORE_BATCH):
+                    await self._store_user_risk_scores_bulk(
+                        risk_scores[i:i + self._SWEEP_STORE_BATCH]
+                    )
+
+                logger.info(f"Recalculated risk for {len(user_ids)} users in org {org_id}")
+
+            except Exception as e:
+                logger.error(f"Failed periodic risk calculation for org {org_id}: {e}")
+
     async def get_risk_recommendations(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Get risk-based recommendations for campaigns or training"""
         org_id = data.get('org_id')
         cohort_id = data.get('cohort_id')
         
-        # Get cohort risk data
-        redis = await get_redis_client()
-        cohort_data = await redis.get(f"cohort_risk:{cohort_id}")
-        
-        if not cohort_data:
-            return {
-                'success': False,
-                'error': 'Cohort risk data not found'
-            }
-        
-        cohort_risk = json.loads(cohort_data)
+        # Get cohort risk data (local cache first, then Redis)
+        cache_key = f"cohort_risk:{cohort_id}"
+        cohort_risk = self._local_get(cache_key)
+
+        if cohort_risk is None:
+            redis = self.redis or get_redis_client()
+            cohort_data = await redis.get(cache_key)
+
+            if not cohort_data:
+                return {
+                    'success': False,
+                    'error': 'Cohort risk data not found'
+                }
+
+            cohort_risk = json.loads(cohort_data)
+            self._local_set(cache_key, cohort_risk)
         
         # Generate adaptive campaign recommendations
         recommendations = {
@@ -655,12 +1068,18 @@ class RiskWorker:
         org_id = data.get('org_id')
         trigger_reason = data.get('trigger_reason', 'high_risk_detected')
         
-        # Get organization risk summary
-        redis = await get_redis_client()
-        high_risk_users = await redis.zrevrangebyscore(
-            f"org_risk_scores:{org_id}",
-            100, 75  # Users with risk score 75-100
-        )
+        # Get organization risk summary (local cache first, then Redis)
+        cache_key = f"high_risk_users:{org_id}"
+        high_risk_users = self._local_get(cache_key)
+
+        if high_risk_users is None:
+            redis = self.redis or get_redis_client()
+            high_risk_users = await redis.zrevrangebyscore(
+                f"org_risk_scores:{org_id}",
+                100, 75  # Users with risk score 75-100
+            )
+            if high_risk_users:
+                self._local_set(cache_key, high_risk_users)
         
         if not high_risk_users:
             return {
@@ -6,48 +6,210 @@ import asyncio
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
-import json
 import hashlib
+import re
+import sys
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from functools import lru_cache
 from user_agents import parse as parse_user_agent
 
-from shared.database import get_clickhouse_client, get_redis_client
-from shared.message_bus import subscribe_to_topic, publish_message, TOPICS
+try:
+    # Optional: a local MaxMind database makes geolocation an in-process
+    # microsecond lookup; without it the mock fallback below runs
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+try:
+    # Optional accelerator: hyperscan compiles the bot patterns into a
+    # JIT'd DFA that scans in one SIMD pass; re remains the fallback
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+from shared.database import ch_insert, get_redis_client
+from shared.message_bus import subscribe_pull_batch, publish_message, respond, wants_reply, TOPICS
 from shared.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass(slots=True)
+class Event:
+    """A validated, enriched event on its way through the pipeline.
+
+    slots=True keeps the per-event footprint to a fixed attribute table
+    instead of a hash table per event, which matters at ingest volume.
+    """
+    id: str
+    event_type: str
+    campaign_id: Optional[str]
+    user_id: Optional[str]
+    org_id: Optional[str]
+    timestamp: datetime
+    ip_address: Optional[str]
+    user_agent: str
+    properties: Dict[str, Any]
+    created_at: datetime
+
+
+@lru_cache(maxsize=10000)
+def _parse_ua_properties(user_agent: str) -> Dict[str, Any]:
+    """Parse a user agent string into event properties.
+
+    Real traffic has very few distinct user agents, so the regex-heavy
+    parse runs once per string instead of once per event. Callers must
+    not mutate the returned dict.
+    """
+    ua = parse_user_agent(user_agent)
+    return {
+        'browser': ua.browser.family,
+        'browser_version': ua.browser.version_string,
+        'os': ua.os.family,
+        'os_version': ua.os.version_string,
+        'device': ua.device.family,
+        'is_mobile': ua.is_mobile,
+        'is_tablet': ua.is_tablet,
+        'is_pc': ua.is_pc
+    }
+
+
 class TelemetryWorker:
+    # Event types accepted for ingestion
+    event_types = frozenset({
+        'email_sent', 'email_opened', 'email_clicked', 'email_reported',
+        'sms_sent', 'sms_clicked', 'sms_reported',
+        'voice_answered', 'voice_completed', 'voice_reported',
+        'chat_sent', 'chat_clicked', 'chat_reported',
+        'landing_visited', 'landing_form_submitted', 'landing_reported',
+        'training_started', 'training_completed', 'quiz_submitted'
+    })
+
+    # Event types that warrant just-in-time coaching
+    COACHING_TRIGGERS = frozenset({
+        'email_clicked', 'sms_clicked', 'landing_visited',
+        'landing_form_submitted', 'chat_clicked'
+    })
+
     def __init__(self):
         self.settings = get_settings()
         self.is_running = False
         self.processed_count = 0
         self.error_count = 0
         
-        # Event types
-        self.event_types = {
-            'email_sent', 'email_opened', 'email_clicked', 'email_reported',
-            'sms_sent', 'sms_clicked', 'sms_reported',
-            'voice_answered', 'voice_completed', 'voice_reported',
-            'chat_sent', 'chat_clicked', 'chat_reported',
-            'landing_visited', 'landing_form_submitted', 'landing_reported',
-            'training_started', 'training_completed', 'quiz_submitted'
+        # Metric hash field per event type, built once and interned so
+        # the hot path reuses one string object per type instead of
+        # formatting (and hashing) a fresh f-string every event
+        self._metric_field = {
+            event_type: sys.intern(f"total_{event_type}")
+            for event_type in self.event_types
         }
         
-        # Bot detection patterns
+        # Bot detection patterns, compiled into one alternation so a
+        # user agent is scanned once instead of once per pattern
         self.bot_patterns = [
             'bot', 'crawler', 'spider', 'scraper', 'scanner',
             'monitor', 'check', 'test', 'probe'
         ]
+        self._bot_pattern_re = re.compile(
+            '|'.join(map(re.escape, self.bot_patterns)), re.IGNORECASE
+        )
+        self._hs_db = None
+        if hyperscan is not None:
+            try:
+                db = hyperscan.Database()
+                db.compile(
+                    expressions=[re.escape(p).encode() for p in self.bot_patterns],
+                    ids=list(range(len(self.bot_patterns))),
+                    flags=[hyperscan.HS_FLAG_CASELESS] * len(self.bot_patterns)
+                )
+                self._hs_db = db
+            except Exception as e:
+                logger.warning(f"hyperscan unavailable, using re for bot scans: {e}")
+
+        # Events awaiting the batched ClickHouse insert; MergeTree wants
+        # large infrequent inserts, not one row per message
+        self._ch_buffer: deque = deque()
+        self._ch_flusher: Optional[asyncio.Task] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+
+        # Metric keys whose TTL this worker has recently armed, so the
+        # hot path doesn't EXPIRE the same key on every event
+        self._ttl_armed: Dict[str, float] = {}
+
+        # Pending counter increments, merged in memory and flushed as
+        # one pipeline: a burst of N events on the same counter becomes
+        # a single HINCRBY by N instead of N Redis ops
+        self._metric_accum: Dict[tuple, int] = defaultdict(int)
+        self._metrics_flusher: Optional[asyncio.Task] = None
+
+        # Last coaching trigger per (user, campaign, event type), so a
+        # click burst coaches the user once instead of per click
+        self._coach_recent: Dict[tuple, float] = {}
+
+        # Coaching payloads awaiting the batched publish; the handler
+        # enqueues synchronously and a flusher publishes per window
+        self._coach_buffer: deque = deque()
+        self._coach_flusher: Optional[asyncio.Task] = None
+
+        # User agent strings already parsed into the lru_cache; hits
+        # stay on the event loop, only cold parses go to a thread
+        self._seen_uas: set = set()
+
+        # Open MaxMind reader when a database is configured
+        self._geoip = None
+        if maxminddb is not None and self.settings.geoip_db_path:
+            try:
+                # MODE_MEMORY loads the database once; lookups are then
+                # pure in-process reads, safe from any task
+                self._geoip = maxminddb.open_database(
+                    self.settings.geoip_db_path, maxminddb.MODE_MEMORY
+                )
+            except Exception as e:
+                logger.warning(f"GeoIP database unavailable, using mock geo data: {e}")
+
+    # Flush cadence for buffered events: whichever of these two is hit
+    # first triggers an insert
+    _CH_FLUSH_INTERVAL = 0.2
+    _CH_BATCH_SIZE = 1000
 
     async def start(self):
         """Start the telemetry worker"""
         self.is_running = True
-        await subscribe_to_topic(TOPICS['event_ingest'], self.handle_event_ingestion, 'telemetry_workers')
+        # Pull-based batches: events in a fetch are handled concurrently
+        # and acked together, and ingest survives worker restarts
+        self._consumer_task = await subscribe_pull_batch(
+            TOPICS['event_ingest'], self.handle_event_ingestion, 'telemetry_workers',
+            batch_size=256
+        )
+
+        # Background flushers for the batched event inserts and the
+        # aggregated metric counters
+        self._ch_flusher = asyncio.create_task(self._flush_events_loop())
+        self._metrics_flusher = asyncio.create_task(self._flush_metrics_loop())
+        self._coach_flusher = asyncio.create_task(self._flush_coaching_loop())
+
         logger.info("Telemetry worker started")
 
     async def stop(self):
         """Stop the telemetry worker"""
         self.is_running = False
+        if self._consumer_task is not None:
+            self._consumer_task.cancel()
+        if self._ch_flusher is not None:
+            self._ch_flusher.cancel()
+        if self._metrics_flusher is not None:
+            self._metrics_flusher.cancel()
+        if self._coach_flusher is not None:
+            self._coach_flusher.cancel()
+        # Drain whatever is still buffered
+        await self._flush_events()
+        await self._flush_metrics()
+        await self._flush_coaching()
+        if self._geoip is not None:
+            self._geoip.close()
         logger.info("Telemetry worker stopped")
 
     async def handle_event_ingestion(self, data: Dict[str, Any], msg):
@@ -74,18 +236,19 @@ class TelemetryWorker:
             # Store in ClickHouse
             await self._store_event(processed_event)
             
-            # Update real-time metrics in Redis
-            await self._update_realtime_metrics(processed_event)
+            # Update real-time metrics (accumulated, flushed in batches)
+            self._update_realtime_metrics(processed_event)
             
-            # Trigger coaching if applicable
-            if self._should_trigger_coaching(processed_event):
-                await self._trigger_coaching(processed_event)
+            # Trigger coaching if applicable, coalescing rapid repeats
+            if (self._should_trigger_coaching(processed_event)
+                    and self._coaching_not_coalesced(processed_event)):
+                self._trigger_coaching(processed_event)
             
             # Send response if reply_to is provided
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': True,
-                    'event_id': processed_event['id']
+                    'event_id': processed_event.id
                 })
             
             self.processed_count += 1
@@ -94,220 +257,348 @@ class TelemetryWorker:
             logger.error(f"Error handling event ingestion: {e}")
             self.error_count += 1
             
-            if msg.reply:
-                await msg.respond({
+            if wants_reply(msg):
+                await respond(msg, {
                     'success': False,
                     'error': str(e)
                 })
 
-    async def process_event(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    async def process_event(self, data: Dict[str, Any]) -> Event:
         """Process and enrich event data"""
-        event = {
-            'id': self._generate_event_id(data),
-            'event_type': data.get('event_type'),
-            'campaign_id': data.get('campaign_id'),
-            'user_id': data.get('user_id'),
-            'org_id': data.get('org_id'),
-            'timestamp': datetime.utcnow(),
-            'ip_address': data.get('ip_address'),
-            'user_agent': data.get('user_agent', ''),
-            'properties': data.get('properties', {}),
-            'created_at': datetime.utcnow()
-        }
-        
-        # Enrich with user agent parsing
-        if event['user_agent']:
-            ua = parse_user_agent(event['user_agent'])
-            event['properties'].update({
-                'browser': ua.browser.family,
-                'browser_version': ua.browser.version_string,
-                'os': ua.os.family,
-                'os_version': ua.os.version_string,
-                'device': ua.device.family,
-                'is_mobile': ua.is_mobile,
-                'is_tablet': ua.is_tablet,
-                'is_pc': ua.is_pc
-            })
-        
+        now = datetime.utcnow()
+        event = Event(
+            id=self._generate_event_id(data, now),
+            # Interned so downstream dict lookups compare by pointer
+            event_type=sys.intern(data['event_type']),
+            campaign_id=data.get('campaign_id'),
+            user_id=data.get('user_id'),
+            org_id=data.get('org_id'),
+            timestamp=now,
+            ip_address=data.get('ip_address'),
+            user_agent=data.get('user_agent', ''),
+            properties=data.get('properties', {}),
+            created_at=now
+        )
+
+        # Enrich with user agent parsing (cached per distinct string).
+        # The first parse of a new string is regex-heavy, so it runs in
+        # a worker thread instead of stalling the event loop; repeats
+        # are dict lookups and stay inline.
+        user_agent = event.user_agent
+        if user_agent:
+            if user_agent in self._seen_uas:
+                properties = _parse_ua_properties(user_agent)
+            else:
+                properties = await asyncio.to_thread(_parse_ua_properties, user_agent)
+                if len(self._seen_uas) >= 10000:
+                    self._seen_uas.clear()
+                self._seen_uas.add(user_agent)
+            event.properties.update(properties)
+
         # Add geolocation if IP is available
-        if event['ip_address']:
-            geo_data = await self._get_geolocation(event['ip_address'])
+        if event.ip_address:
+            geo_data = self._get_geolocation(event.ip_address)
             if geo_data:
-                event['properties'].update(geo_data)
-        
+                event.properties.update(geo_data)
+
         return event
 
-    def _generate_event_id(self, data: Dict[str, Any]) -> str:
-        """Generate unique event ID"""
-        key_data = f"{data.get('event_type')}_{data.get('campaign_id')}_{data.get('user_id')}_{datetime.utcnow().isoformat()}"
-        return hashlib.sha256(key_data.encode()).hexdigest()[:16]
+    def _generate_event_id(self, data: Dict[str, Any], now: datetime) -> str:
+        """Generate unique event ID.
+
+        A client-supplied timestamp makes the id deterministic, so a
+        retransmitted event hashes to the same id and the Redis dedup
+        actually catches it; the shared server clock is the fallback.
+        """
+        occurred_at = data.get('client_timestamp') or now.isoformat()
+        key_data = f"{data.get('event_type')}_{data.get('campaign_id')}_{data.get('user_id')}_{occurred_at}"
+        # blake2b is noticeably faster than sha256 for these short keys,
+        # and the id is an identifier, not a security boundary
+        return hashlib.blake2b(key_data.encode(), digest_size=8).hexdigest()
 
-    async def _is_bot_traffic(self, event: Dict[str, Any]) -> bool:
+    async def _is_bot_traffic(self, event: Event) -> bool:
         """Detect bot/automated traffic"""
-        user_agent = event.get('user_agent', '').lower()
-        
+        user_agent = event.user_agent
+
         # Check for bot patterns in user agent
-        for pattern in self.bot_patterns:
-            if pattern in user_agent:
-                return True
-        
+        if user_agent and self._matches_bot_pattern(user_agent):
+            return True
+
         # Check for suspicious timing patterns
         if await self._has_suspicious_timing(event):
             return True
-        
+
         # Check for known bot IPs
-        if await self._is_known_bot_ip(event.get('ip_address')):
+        if self._is_known_bot_ip(event.ip_address):
             return True
         
         return False
 
-    async def _has_suspicious_timing(self, event: Dict[str, Any]) -> bool:
-        """Check for suspicious timing patterns"""
-        redis = await get_redis_client()
-        
-        # Check for rapid-fire events from same user
-        user_key = f"user_events:{event['user_id']}"
-        recent_events = await redis.lrange(user_key, 0, 10)
-        
-        if len(recent_events) > 5:
-            # More than 5 events in recent history, check timing
-            timestamps = [float(ts) for ts in recent_events]
-            if len(timestamps) > 1:
-                time_diffs = [timestamps[i] - timestamps[i+1] for i in range(len(timestamps)-1)]
-                avg_diff = sum(time_diffs) / len(time_diffs)
-                
-                # If average time between events is less than 1 second, likely bot
-                if avg_diff < 1.0:
-                    return True
-        
-        # Add current event timestamp
-        await redis.lpush(user_key, event['timestamp'].timestamp())
-        await redis.ltrim(user_key, 0, 10)  # Keep only recent 10 events
-        await redis.expire(user_key, 3600)  # 1 hour TTL
-        
-        return False
+    def _matches_bot_pattern(self, user_agent: str) -> bool:
+        """Scan a user agent against the bot patterns in one pass"""
+        if self._hs_db is not None:
+            hits: List[int] = []
+            self._hs_db.scan(
+                user_agent.encode(),
+                match_event_handler=lambda pat_id, start, end, flags, ctx: hits.append(pat_id)
+            )
+            return bool(hits)
+
+        return self._bot_pattern_re.search(user_agent) is not None
+
+    # A human doesn't produce more than this many events in the window
+    _TIMING_WINDOW = 5.0
+    _TIMING_MAX_EVENTS = 5
+
+    async def _has_suspicious_timing(self, event: Event) -> bool:
+        """Check for suspicious timing patterns.
+
+        A per-user sorted set keyed by timestamp holds the sliding
+        window; record, trim, count and TTL all go out in one pipeline
+        instead of the old LRANGE/LPUSH/LTRIM/EXPIRE round-trips.
+        """
+        redis = get_redis_client()
+
+        user_key = f"user_events:{event.user_id}"
+        now = event.timestamp.timestamp()
+
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(user_key, {event.id: now})
+            pipe.zremrangebyscore(user_key, '-inf', now - self._TIMING_WINDOW)
+            pipe.zcard(user_key)
+            pipe.expire(user_key, 3600)  # 1 hour TTL
+            _, _, window_count, _ = await pipe.execute()
+
+        # More events in the window than a human plausibly produces
+        return window_count > self._TIMING_MAX_EVENTS
+
+    # Known bot/scanner IPs; a frozenset gives O(1) membership however
+    # large a real bot database grows. This would be populated from
+    # actual bot IP feeds.
+    BOT_IPS = frozenset({
+        '127.0.0.1',  # localhost
+        '0.0.0.0'     # invalid
+    })
 
-    async def _is_known_bot_ip(self, ip_address: str) -> bool:
+    def _is_known_bot_ip(self, ip_address: str) -> bool:
         """Check if IP is from known bot/scanner"""
         if not ip_address:
             return False
-        
-        # Check against known bot IP ranges
-        # This would be implemented with actual bot IP databases
-        bot_ip_ranges = [
-            '127.0.0.1',  # localhost
-            '0.0.0.0'     # invalid
-        ]
-        
-        return ip_address in bot_ip_ranges
 
-    async def _is_duplicate_event(self, event: Dict[str, Any]) -> bool:
+        return ip_address in self.BOT_IPS
+
+    async def _is_duplicate_event(self, event: Event) -> bool:
         """Check for duplicate events"""
-        redis = await get_redis_client()
-        
-        # Create deduplication key
-        dedup_key = f"event_dedup:{event['id']}"
-        
-        # Check if event already exists
-        exists = await redis.exists(dedup_key)
-        if exists:
-            return True
-        
-        # Mark event as seen
-        await redis.setex(dedup_key, 3600, "1")  # 1 hour TTL
-        return False
+        redis = get_redis_client()
+
+        # Claim the dedup key atomically: SET NX only succeeds for the
+        # first worker to see this event, in one round-trip instead of
+        # the racy EXISTS + SETEX pair
+        dedup_key = f"event_dedup:{event.id}"
+        claimed = await redis.set(dedup_key, "1", nx=True, ex=3600)  # 1 hour TTL
+        return not claimed
+
+    EVENT_COLUMNS = [
+        'id', 'event_type', 'campaign_id', 'user_id', 'org_id',
+        'timestamp', 'properties', 'user_agent', 'ip_address', 'created_at'
+    ]
+
+    async def _store_event(self, event: Event):
+        """Queue event for the batched ClickHouse insert"""
+        self._ch_buffer.append({
+            'id': event.id,
+            'event_type': event.event_type,
+            'campaign_id': event.campaign_id or '',
+            'user_id': event.user_id or '',
+            'org_id': event.org_id or '',
+            'timestamp': event.timestamp,
+            # The events.properties column is Map(String, String); hand
+            # the driver a dict instead of a JSON blob so values stay
+            # queryable as properties['key'] without JSONExtract
+            'properties': {str(k): str(v) for k, v in event.properties.items()},
+            'user_agent': event.user_agent,
+            'ip_address': event.ip_address or '0.0.0.0',
+            'created_at': event.created_at
+        })
+
+        # Bursts flush on size without waiting for the timer
+        if len(self._ch_buffer) >= self._CH_BATCH_SIZE:
+            await self._flush_events()
+
+    async def _flush_events_loop(self):
+        while True:
+            await asyncio.sleep(self._CH_FLUSH_INTERVAL)
+            try:
+                await self._flush_events()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event flush failed: {e}")
+
+    async def _flush_events(self):
+        """Insert all buffered events in one batch"""
+        rows = []
+        while self._ch_buffer:
+            rows.append(self._ch_buffer.popleft())
+        if not rows:
+            return
 
-    async def _store_event(self, event: Dict[str, Any]):
-        """Store event in ClickHouse"""
-        clickhouse = get_clickhouse_client()
-        
         try:
-            # Prepare data for ClickHouse
-            ch_data = {
-                'id': event['id'],
-                'event_type': event['event_type'],
-                'campaign_id': event['campaign_id'] or '',
-                'user_id': event['user_id'] or '',
-                'org_id': event['org_id'] or '',
-                'timestamp': event['timestamp'],
-                'properties': json.dumps(event['properties']),
-                'user_agent': event['user_agent'],
-                'ip_address': event['ip_address'] or '0.0.0.0',
-                'created_at': event['created_at']
-            }
-            
-            # Insert into events table
-            clickhouse.execute(
-                """
-                INSERT INTO ai_defense_events.events 
-                (id, event_type, campaign_id, user_id, org_id, timestamp, properties, user_agent, ip_address, created_at)
-                VALUES
-                """,
-                [ch_data]
-            )
-            
-            logger.debug(f"Event stored in ClickHouse: {event['id']}")
-            
+            await ch_insert('ai_defense_events.events', rows, self.EVENT_COLUMNS)
+            logger.debug(f"Stored {len(rows)} events in ClickHouse")
         except Exception as e:
-            logger.error(f"Failed to store event in ClickHouse: {e}")
-            raise
+            logger.error(f"Batch insert of {len(rows)} events failed, retrying per row: {e}")
+            # Per-row fallback so one bad row can't sink the whole batch
+            for row in rows:
+                try:
+                    await ch_insert('ai_defense_events.events', [row], self.EVENT_COLUMNS)
+                except Exception as row_error:
+                    logger.error(f"Failed to store event {row['id']}: {row_error}")
+
+    # Re-arm a metric key's TTL at most this often (half the 24h TTL)
+    _METRIC_TTL_REARM = 43200.0
+
+    def _needs_ttl(self, key: str) -> bool:
+        """True when this worker should (re)set the key's expiry"""
+        now = time.monotonic()
+        armed_at = self._ttl_armed.get(key)
+        if armed_at is not None and now - armed_at < self._METRIC_TTL_REARM:
+            return False
+        if len(self._ttl_armed) >= 100000:
+            self._ttl_armed.clear()
+        self._ttl_armed[key] = now
+        return True
+
+    _METRICS_FLUSH_INTERVAL = 2.0
+
+    def _update_realtime_metrics(self, event: Event):
+        """Accumulate real-time metric increments in memory.
+
+        The hot path touches no Redis at all; increments merge locally
+        per (key, field) and the flusher pushes the net counts every
+        couple of seconds in one pipeline. Counter semantics are
+        unchanged, readers just see them at flush granularity.
+        """
+        field = self._metric_field[event.event_type]
+        accum = self._metric_accum
+        accum[(f"metrics:campaign:{event.campaign_id}", field)] += 1  # Campaign-level
+        accum[(f"metrics:org:{event.org_id}", field)] += 1            # Organization-level
+        accum[(f"metrics:user:{event.user_id}", field)] += 1          # User-level
+        accum[("metrics:global", field)] += 1                         # Global
+
+    async def _flush_metrics_loop(self):
+        while True:
+            await asyncio.sleep(self._METRICS_FLUSH_INTERVAL)
+            try:
+                await self._flush_metrics()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Metrics flush failed: {e}")
+
+    async def _flush_metrics(self):
+        """Push the accumulated counter deltas to Redis in one pipeline"""
+        if not self._metric_accum:
+            return
+
+        accum, self._metric_accum = self._metric_accum, defaultdict(int)
+        redis = get_redis_client()
 
-    async def _update_realtime_metrics(self, event: Dict[str, Any]):
-        """Update real-time metrics in Redis"""
-        redis = await get_redis_client()
-        
         try:
-            # Campaign-level metrics
-            campaign_key = f"metrics:campaign:{event['campaign_id']}"
-            await redis.hincrby(campaign_key, f"total_{event['event_type']}", 1)
-            await redis.expire(campaign_key, 86400)  # 24 hours TTL
-            
-            # Organization-level metrics
-            org_key = f"metrics:org:{event['org_id']}"
-            await redis.hincrby(org_key, f"total_{event['event_type']}", 1)
-            await redis.expire(org_key, 86400)
-            
-            # User-level metrics
-            user_key = f"metrics:user:{event['user_id']}"
-            await redis.hincrby(user_key, f"total_{event['event_type']}", 1)
-            await redis.expire(user_key, 86400)
-            
-            # Global metrics
-            global_key = "metrics:global"
-            await redis.hincrby(global_key, f"total_{event['event_type']}", 1)
-            await redis.expire(global_key, 86400)
-            
+            async with redis.pipeline(transaction=False) as pipe:
+                for (key, field), count in accum.items():
+                    pipe.hincrby(key, field, count)
+                    if self._needs_ttl(key):
+                        pipe.expire(key, 86400)  # 24 hours TTL
+                await pipe.execute()
+
         except Exception as e:
+            # Merge the deltas back so the counts aren't lost
+            for entry, count in accum.items():
+                self._metric_accum[entry] += count
             logger.error(f"Failed to update real-time metrics: {e}")
 
-    def _should_trigger_coaching(self, event: Dict[str, Any]) -> bool:
+    # Rapid repeats of the same coaching trigger within this window are
+    # coalesced; the raw events still hit ClickHouse and the metrics
+    _COACH_COALESCE_WINDOW = 60.0
+
+    def _coaching_not_coalesced(self, event: Event) -> bool:
+        """True when this trigger isn't a rapid repeat of a recent one"""
+        key = (event.user_id, event.campaign_id, event.event_type)
+        now = time.monotonic()
+        last = self._coach_recent.get(key)
+        if last is not None and now - last < self._COACH_COALESCE_WINDOW:
+            return False
+        if len(self._coach_recent) >= 100000:
+            self._coach_recent.clear()
+        self._coach_recent[key] = now
+        return True
+
+    def _should_trigger_coaching(self, event: Event) -> bool:
         """Determine if coaching should be triggered for this event"""
-        coaching_triggers = {
-            'email_clicked', 'sms_clicked', 'landing_visited', 
-            'landing_form_submitted', 'chat_clicked'
-        }
-        
-        return event['event_type'] in coaching_triggers
+        return event.event_type in self.COACHING_TRIGGERS
 
-    async def _trigger_coaching(self, event: Dict[str, Any]):
-        """Trigger just-in-time coaching"""
-        coaching_data = {
+    def _trigger_coaching(self, event: Event):
+        """Queue just-in-time coaching for the batched publish"""
+        self._coach_buffer.append({
             'type': 'trigger_coaching',
-            'event_id': event['id'],
-            'event_type': event['event_type'],
-            'user_id': event['user_id'],
-            'campaign_id': event['campaign_id'],
-            'org_id': event['org_id'],
-            'context': event['properties']
-        }
-        
-        await publish_message(TOPICS['coach_send'], coaching_data)
-        logger.info(f"Coaching triggered for event: {event['id']}")
+            'event_id': event.id,
+            'event_type': event.event_type,
+            'user_id': event.user_id,
+            'campaign_id': event.campaign_id,
+            'org_id': event.org_id,
+            'context': event.properties
+        })
+
+    _COACH_FLUSH_INTERVAL = 0.2
 
-    async def _get_geolocation(self, ip_address: str) -> Optional[Dict[str, Any]]:
+    async def _flush_coaching_loop(self):
+        while True:
+            await asyncio.sleep(self._COACH_FLUSH_INTERVAL)
+            try:
+                await self._flush_coaching()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Coaching flush failed: {e}")
+
+    async def _flush_coaching(self):
+        """Publish the queued coaching triggers in one burst"""
+        batch = []
+        while self._coach_buffer:
+            batch.append(self._coach_buffer.popleft())
+        if not batch:
+            return
+
+        # One gather pushes the whole window through the client's write
+        # buffer together instead of an awaited publish per event
+        await asyncio.gather(*(
+            publish_message(TOPICS['coach_send'], coaching_data)
+            for coaching_data in batch
+        ))
+        logger.info(f"Coaching triggered for {len(batch)} events")
+
+    def _get_geolocation(self, ip_address: str) -> Optional[Dict[str, Any]]:
         """Get geolocation data for IP address"""
-        # This would integrate with a geolocation service
-        # For now, return mock data for localhost
+        if self._geoip is not None:
+            try:
+                record = self._geoip.get(ip_address)
+            except ValueError:
+                return None  # not a routable IP string
+            if not record:
+                return None
+            subdivisions = record.get('subdivisions') or [{}]
+            location = record.get('location', {})
+            return {
+                'country': record.get('country', {}).get('iso_code'),
+                'region': subdivisions[0].get('iso_code'),
+                'city': record.get('city', {}).get('names', {}).get('en'),
+                'latitude': location.get('latitude'),
+                'longitude': location.get('longitude'),
+                'timezone': location.get('time_zone')
+            }
+
+        # No database configured: return mock data for localhost
         if ip_address in ['127.0.0.1', 'localhost']:
             return {
                 'country': 'US',
@@ -322,7 +613,7 @@ class TelemetryWorker:
 
     async def get_campaign_metrics(self, campaign_id: str) -> Dict[str, Any]:
         """Get real-time metrics for a campaign"""
-        redis = await get_redis_client()
+        redis = get_redis_client()
         
         campaign_key = f"metrics:campaign:{campaign_id}"
         metrics = await redis.hgetall(campaign_key)
@@ -335,7 +626,7 @@ class TelemetryWorker:
 
     async def get_user_metrics(self, user_id: str) -> Dict[str, Any]:
         """Get real-time metrics for a user"""
-        redis = await get_redis_client()
+        redis = get_redis_client()
         
         user_key = f"metrics:user:{user_id}"
         metrics = await redis.hgetall(user_key)
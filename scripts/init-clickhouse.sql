@@ -18,6 +18,17 @@ ORDER BY (org_id, campaign_id, timestamp)
 PARTITION BY toYYYYMM(timestamp)
 TTL timestamp + INTERVAL 2 YEAR;
 
+-- Per-user risk scores; ReplacingMergeTree keeps the newest row per
+-- (org, user) so cohort aggregates and trends run as single queries
+CREATE TABLE IF NOT EXISTS ai_defense_events.risk_scores (
+    org_id UUID,
+    user_id UUID,
+    overall_score Float64,
+    risk_level LowCardinality(String),
+    last_updated DateTime64(3) DEFAULT now64()
+) ENGINE = ReplacingMergeTree(last_updated)
+ORDER BY (org_id, user_id);
+
 -- Create materialized views for common analytics queries
 CREATE MATERIALIZED VIEW IF NOT EXISTS ai_defense_events.campaign_stats
 ENGINE = SummingMergeTree()